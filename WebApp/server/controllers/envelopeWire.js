@@ -0,0 +1,142 @@
+// Decoder for the devices' compact envelope result batches (code/wire_format.py).
+// Expands a batch back into the same objects the devices send as JSON:
+// { IMB: [{ Barcode, BBox, Score, Confidence, "IMB Patterns", "IMB Data", Rung }],
+//   OCR: { field: [values] }, LOCATION, TIME, DATE }
+// Version 1 records (u8 counts, no Score/Confidence/"IMB Data"/Rung) are still accepted.
+
+const zlib = require("zlib");
+
+const MAGIC = "EBW1";
+const VERSIONS = [1, 2];
+const CONTENT_TYPE = "application/x-ebox-batch";
+const BAR_CODES = "FADT";
+const OCR_FIELDS = ["ZIP Codes", "State Abbreviations", "Addresses"];
+const OTHER_FIELD = 255;
+const FIXED_POINT = 10000;
+// Largest inflated batch accepted. A device batch (16 envelopes) inflates to a few KB;
+// the same results as JSON must fit express.json's 100 KB limit. Without a cap a small
+// compressed body could expand without bound in the request handler.
+const MAX_INFLATED_BYTES = 1024 * 1024;
+
+const pad = (n) => String(n).padStart(2, "0");
+
+// Same split as imb_decoder.split_tracking: mailer IDs starting with 9 are 9 digits
+const splitTracking = (tracking, routing) => {
+  const mailerLength = tracking[5] === "9" ? 9 : 6;
+  return {
+    barcode_id: tracking.slice(0, 2),
+    service_type: tracking.slice(2, 5),
+    mailer_id: tracking.slice(5, 5 + mailerLength),
+    serial: tracking.slice(5 + mailerLength, 20),
+    routing,
+    tracking,
+  };
+};
+
+const decodeBatch = (data) => {
+  if (data.subarray(0, 4).toString("latin1") !== MAGIC) {
+    throw new Error("Not an envelope wire batch");
+  }
+  let buf;
+  try {
+    buf = zlib.inflateSync(data.subarray(4), { maxOutputLength: MAX_INFLATED_BYTES });
+  } catch (err) {
+    if (err.code === "ERR_BUFFER_TOO_LARGE") {
+      throw new Error(`Envelope wire batch inflates past ${MAX_INFLATED_BYTES} bytes`);
+    }
+    throw err;
+  }
+  let offset = 0;
+  let version = 0;
+
+  const u8 = () => buf.readUInt8(offset++);
+  const u16 = () => {
+    const value = buf.readUInt16LE(offset);
+    offset += 2;
+    return value;
+  };
+  // Counts and string lengths are u8 in version 1 records, u16 from version 2
+  const count = () => (version >= 2 ? u16() : u8());
+  const str = () => {
+    const length = count();
+    const value = buf.toString("utf8", offset, offset + length);
+    offset += length;
+    return value;
+  };
+  const bars = (n) => {
+    let pattern = "";
+    for (let i = 0; i < n; i++) {
+      const byte = buf[offset + (i >> 2)];
+      pattern += BAR_CODES[(byte >> (6 - 2 * (i & 3))) & 3];
+    }
+    offset += Math.ceil(n / 4);
+    return pattern;
+  };
+
+  const recordCount = u16();
+  const records = [];
+  for (let r = 0; r < recordCount; r++) {
+    version = u8();
+    if (!VERSIONS.includes(version)) {
+      throw new Error(`Unsupported wire record version ${version}`);
+    }
+    // Device-local wall time, so read it back as UTC to avoid shifting it again
+    const moment = new Date(buf.readUInt32LE(offset) * 1000);
+    offset += 4;
+    const LOCATION = str();
+
+    const IMB = [];
+    const barcodeCount = count();
+    for (let i = 0; i < barcodeCount; i++) {
+      const BBox = [buf.readInt16LE(offset), buf.readInt16LE(offset + 2),
+                    buf.readUInt16LE(offset + 4), buf.readUInt16LE(offset + 6)];
+      offset += 8;
+      const entry = { Barcode: `barcode_${i + 1}`, BBox };
+      let rung = "";
+      let tracking = "";
+      let routing = "";
+      if (version >= 2) {
+        entry.Score = u16() / FIXED_POINT;
+        entry.Confidence = u16() / FIXED_POINT;
+        rung = str();
+        tracking = str();
+        routing = str();
+      }
+      const patterns = [];
+      const patternCount = count();
+      for (let p = 0; p < patternCount; p++) {
+        patterns.push(bars(count()));
+      }
+      entry["IMB Patterns"] = patterns.length ? patterns.join(", ") : "None";
+      if (version >= 2) {
+        entry["IMB Data"] = tracking ? splitTracking(tracking, routing) : null;
+        entry.Rung = rung || null;
+      }
+      IMB.push(entry);
+    }
+
+    const OCR = {};
+    const fieldCount = count();
+    for (let f = 0; f < fieldCount; f++) {
+      const field = u8();
+      const name = field === OTHER_FIELD ? str() : OCR_FIELDS[field];
+      const values = [];
+      const valueCount = count();
+      for (let v = 0; v < valueCount; v++) {
+        values.push(str());
+      }
+      OCR[name] = values;
+    }
+
+    records.push({
+      IMB,
+      OCR,
+      LOCATION,
+      TIME: `${pad(moment.getUTCHours())}:${pad(moment.getUTCMinutes())}:${pad(moment.getUTCSeconds())}`,
+      DATE: moment.toISOString().slice(0, 10),
+    });
+  }
+  return records;
+};
+
+module.exports = { decodeBatch, CONTENT_TYPE, MAX_INFLATED_BYTES };
@@ -31,6 +31,7 @@ const connectDB = require("./config/db");
 const loginRoute = require("./route/loginSignupRoute");
 const cookieParser = require("cookie-parser");
 const cors = require('cors');
+const envelopeWire = require("./controllers/envelopeWire");
 require("dotenv").config();
 
 const app = express();
@@ -85,20 +86,37 @@ app.get('/test', (req, res) => {
   });
 });
 
-// Example POST route
-app.post('/envelopeData', (req, res) => {
-  const { IMB, DATE, TIME, LOCATION, OCR } = req.body;
+// Envelope results from the devices. The body is either one result or, from the
+// device's batching uploader, an array of results inserted in one statement. Batches
+// can also arrive in the compact binary format (see controllers/envelopeWire.js).
+app.post('/envelopeData', express.raw({ type: envelopeWire.CONTENT_TYPE, limit: '1mb' }), (req, res) => {
+  let records;
+  try {
+    records = Buffer.isBuffer(req.body) ? envelopeWire.decodeBatch(req.body)
+      : Array.isArray(req.body) ? req.body : [req.body];
+  } catch (err) {
+    console.error('Could not decode ballot data:', err);
+    res.status(400).send('Malformed ballot data.');
+    return;
+  }
+  if (records.length === 0) {
+    res.status(400).send('No ballot data.');
+    return;
+  }
+  const toColumn = (value) => (typeof value === 'object' && value !== null ? JSON.stringify(value) : value);
+  const rows = records.map(({ IMB, DATE, TIME, LOCATION, OCR }) =>
+    [toColumn(IMB), DATE, TIME, LOCATION, toColumn(OCR)]);
 
   connection.query(
-    'INSERT INTO ballots (barcode_data, date, time, location, name) VALUES (?, ?, ?, ?, ?)',
-    [IMB, DATE, TIME, LOCATION, OCR],
+    'INSERT INTO ballots (barcode_data, date, time, location, name) VALUES ?',
+    [rows],
     (err, results) => {
       if (err) {
         console.error('Error pushing ballot data:', err);
         res.status(500).send('Server error');
         return;
       }
-      res.status(200).send("Ballot data saved.");
+      res.status(200).send(`Ballot data saved (${rows.length}).`);
     }
   );
 });
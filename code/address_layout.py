@@ -0,0 +1,116 @@
+import cv2
+import numpy as np
+from envelope_image import EnvelopeImage
+
+# Layout stage for OCR: instead of running Tesseract over the whole envelope, find the
+# text blocks that are likely to be the address and OCR only those, each scaled so its
+# text lines are about TARGET_LINE_HEIGHT pixels tall.
+
+LAYOUT_SCALE = 0.5          # thumbnail scale for block detection
+MIN_BLOCK_SIZE = (60, 16)   # (w, h) in full-resolution pixels
+MAX_ADDRESS_BLOCKS = 2
+BLOCK_PADDING = 8
+TARGET_LINE_HEIGHT = 32     # Tesseract is most accurate with ~20-30 px x-height
+MIN_OCR_SCALE = 0.35
+MAX_OCR_SCALE = 2.0
+
+
+def find_text_blocks(gray, scale=LAYOUT_SCALE):
+    """
+    Finds blocks of text lines on a thumbnail of `gray` (an array or EnvelopeImage).
+    Returns a list of (x, y, w, h) boxes in full-resolution coordinates.
+    """
+    thumb = EnvelopeImage.wrap(gray).scaled(scale)
+    gradient = cv2.morphologyEx(thumb, cv2.MORPH_GRADIENT,
+                                cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3)))
+    _, mask = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # Join characters into lines, then neighbouring lines into blocks
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (15, 1)))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (1, 9)))
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    blocks = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        x, y, w, h = int(x / scale), int(y / scale), int(np.ceil(w / scale)), int(np.ceil(h / scale))
+        if w >= MIN_BLOCK_SIZE[0] and h >= MIN_BLOCK_SIZE[1]:
+            blocks.append((x, y, w, h))
+    return blocks
+
+
+def _overlap(a0, a1, b0, b1):
+    return max(0, min(a1, b1) - max(a0, b0))
+
+
+def address_regions(gray, imb_bbox=None, max_blocks=MAX_ADDRESS_BLOCKS):
+    """
+    Picks the text blocks most likely to hold the delivery address.
+
+    With the IMB location as anchor, blocks that share its columns and sit closest to it
+    vertically win (the IMB is printed just above or below the address). The IMB band
+    itself is never returned. Without an anchor, the largest blocks win.
+
+    Returns up to `max_blocks` padded (x, y, w, h) boxes, best first.
+    """
+    env = EnvelopeImage.wrap(gray)
+    img_h, img_w = env.shape[:2]
+    scored = []
+    for x, y, w, h in find_text_blocks(env):
+        if imb_bbox is None:
+            scored.append((w * h, (x, y, w, h)))
+            continue
+        bx, by, bw, bh = imb_bbox
+        # Skip the barcode itself
+        if _overlap(y, y + h, by, by + bh) > 0.5 * min(h, bh) and _overlap(x, x + w, bx, bx + bw) > 0.5 * min(w, bw):
+            continue
+        shared_cols = _overlap(x, x + w, bx, bx + bw) / float(min(w, bw))
+        if shared_cols == 0:
+            continue
+        gap = max(0, by - (y + h), y - (by + bh))
+        scored.append((shared_cols / (1.0 + gap / float(bh)), (x, y, w, h)))
+
+    scored.sort(key=lambda s: s[0], reverse=True)
+    regions = []
+    for _, (x, y, w, h) in scored[:max_blocks]:
+        x1, y1 = max(0, x - BLOCK_PADDING), max(0, y - BLOCK_PADDING)
+        x2, y2 = min(img_w, x + w + BLOCK_PADDING), min(img_h, y + h + BLOCK_PADDING)
+        regions.append((x1, y1, x2 - x1, y2 - y1))
+    return regions
+
+
+def estimate_line_height(crop):
+    """Median height of the text lines in a crop, from its row ink profile."""
+    _, binary = cv2.threshold(crop, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    rows = binary.sum(axis=1) > max(1, 0.02 * crop.shape[1])
+    # Run lengths of consecutive inked rows
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], rows.astype(np.int8), [0]))))
+    runs = edges[1::2] - edges[::2]
+    runs = runs[runs >= 4]
+    if len(runs) == 0:
+        return None
+    return float(np.median(runs))
+
+
+def prepare_for_ocr(crop):
+    """Rescales a text crop so its lines are about TARGET_LINE_HEIGHT pixels tall."""
+    line_height = estimate_line_height(crop)
+    if line_height is None:
+        return crop
+    factor = min(MAX_OCR_SCALE, max(MIN_OCR_SCALE, TARGET_LINE_HEIGHT / line_height))
+    if 0.9 < factor < 1.1:
+        return crop
+    interpolation = cv2.INTER_AREA if factor < 1 else cv2.INTER_CUBIC
+    return cv2.resize(crop, None, fx=factor, fy=factor, interpolation=interpolation)
+
+
+def address_crops(gray, imb_bbox=None, max_blocks=MAX_ADDRESS_BLOCKS):
+    """
+    The likely address blocks of an envelope, cropped and scaled for OCR.
+    Returns a list of ((x, y, w, h), crop) tuples, best first.
+    """
+    env = EnvelopeImage.wrap(gray)
+    gray = env.view("gray")
+    crops = []
+    for x, y, w, h in address_regions(env, imb_bbox, max_blocks):
+        crops.append(((x, y, w, h), prepare_for_ocr(gray[y:y + h, x:x + w])))
+    return crops
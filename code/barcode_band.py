@@ -0,0 +1,55 @@
+import cv2
+import numpy as np
+from envelope_image import EnvelopeImage
+
+# Cheap IMB localization on a thumbnail. An IMB is a long, thin band of closely spaced
+# vertical bars, so it shows up as a wide, short region where horizontal gradients
+# (bar edges) strongly dominate vertical ones. Text has both, so it scores much lower.
+
+BAND_SCALE = 0.5          # thumbnail scale used for localization
+MIN_BAND_ASPECT = 5.0     # IMBs are ~3in x 0.15in; text blocks are much squarer
+MIN_BAND_WIDTH = 120      # in full-resolution pixels
+MIN_EDGE_RATIO = 2.0      # mean |dI/dx| over mean |dI/dy| inside the band
+
+
+def locate_barcode_band(gray, scale=BAND_SCALE):
+    """
+    Finds the region most likely to hold an IMB.
+
+    Parameters:
+        gray (np.array or EnvelopeImage): Single-channel image (BGR input is converted).
+        scale (float): Thumbnail scale the search runs at.
+
+    Returns:
+        (x, y, w, h) of the band in full-resolution coordinates, or None.
+    """
+    thumb = EnvelopeImage.wrap(gray).scaled(scale)
+
+    grad_x = cv2.convertScaleAbs(cv2.Sobel(thumb, cv2.CV_16S, 1, 0, ksize=3))
+    grad_y = cv2.convertScaleAbs(cv2.Sobel(thumb, cv2.CV_16S, 0, 1, ksize=3))
+    vertical_edges = cv2.subtract(grad_x, grad_y)
+
+    blurred = cv2.blur(vertical_edges, (3, 3))
+    _, mask = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # Bridge the gaps between bars so the whole barcode becomes one blob
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (9, 3)))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (5, 1)))
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    best, best_score = None, 0.0
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if w < MIN_BAND_WIDTH * scale or w < MIN_BAND_ASPECT * h:
+            continue
+        gx = float(np.mean(grad_x[y:y + h, x:x + w]))
+        gy = float(np.mean(grad_y[y:y + h, x:x + w])) + 1.0
+        if gx / gy < MIN_EDGE_RATIO:
+            continue
+        score = (gx - gy) * w
+        if score > best_score:
+            best, best_score = (x, y, w, h), score
+
+    if best is None:
+        return None
+    x, y, w, h = best
+    return (int(x / scale), int(y / scale), int(np.ceil(w / scale)), int(np.ceil(h / scale)))
@@ -2,75 +2,40 @@ import os
 import cv2
 import numpy as np
 import argparse
-
-# Parse command-line arguments
-parser = argparse.ArgumentParser(description="Barcode detection script")
-parser.add_argument("image_path", type=str, help="Path to the input image")
-args = parser.parse_args()
+from envelope_image import EnvelopeImage
+from debug_context import DebugContext
 
 DEBUG = False
 
-# Validate image path
-if not os.path.exists(args.image_path):
-    print(f"Error: The file '{args.image_path}' does not exist.")
-    exit(1)
-
-# Define output directories
+# Define output directories (only written and cleaned by the CLI; the pipeline passes a
+# per-envelope DebugContext instead)
 output_dir = "./barcode_extraction_debug"
 barcode_dir = "./barcodes"
 
-# Ensure the preprocessing folder is clean before each run
-for directory in [output_dir, barcode_dir]:
-    if os.path.exists(directory):
-        for file in os.listdir(directory):
-            os.remove(os.path.join(directory, file))
-    else:
-        os.makedirs(directory)
-
-# Load the image
-image = cv2.imread(args.image_path)
-
-# Convert to grayscale
-gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-# Step 1: Reduce noise and enhance barcode structure
-blurred_refined = cv2.GaussianBlur(gray, (7, 7), 0)
-cv2.imwrite(os.path.join(output_dir, "0_blurred.png"), blurred_refined)
-
-# Apply adaptive thresholding for better barcode contrast
-thresh_refined = cv2.adaptiveThreshold(
-    blurred_refined, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 17, 5
-)
-cv2.imwrite(os.path.join(output_dir, "1_adaptive_threshold.png"), thresh_refined)
-
-# Step 2: Use two-stage morphological operations
-
-# First: Closing to connect barcode gaps
-kernel_close = cv2.getStructuringElement(cv2.MORPH_RECT, (18, 6))
-morph_closed = cv2.morphologyEx(thresh_refined, cv2.MORPH_CLOSE, kernel_close)
-cv2.imwrite(os.path.join(output_dir, "2_morphological_closing.png"), morph_closed)
-
-# Second: Opening to remove small noise
-kernel_open = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
-morph_refined = cv2.morphologyEx(morph_closed, cv2.MORPH_OPEN, kernel_open)
-cv2.imwrite(os.path.join(output_dir, "3_morphological_opening.png"), morph_refined)
-
-# Step 3: Find contours (Initial barcode candidates)
-contours_final, _ = cv2.findContours(morph_refined, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-
-# Draw contours on the image for visualization
-contour_visualization_final = image.copy()
-cv2.drawContours(contour_visualization_final, contours_final, -1, (0, 255, 0), 2)
-cv2.imwrite(os.path.join(output_dir, "4_contour_detection.png"), contour_visualization_final)
-
-# Step 4: Filter candidates using size, aspect ratio, and additional barcode detection methods
-barcode_counter_final = 0
-filtered_visualization_final = image.copy()
-real_barcodes = []  # Store final valid barcodes
-
 # Define padding amount (in pixels)
 PADDING = 10  # Adjust as needed
 
+# Bar count range accepted as an IMB (65 bars, some lost or merged at low resolution)
+MIN_BARS = 35
+MAX_BARS = 66
+# Central rows of a candidate used for the column profile: every IMB bar (F, A, D and T)
+# crosses the tracker band in the middle of the barcode
+TRACKER_BAND = (0.4, 0.6)
+
+# IMB print spec (USPS-B-3200): 20-24 bars per inch, bars 0.015-0.025 in wide and
+# 0.125-0.165 in tall (full bar). As ratios to the bar pitch, widened for print and
+# capture blur:
+WIDTH_TO_PITCH = (0.25, 0.70)    # spec 0.30-0.60
+HEIGHT_TO_PITCH = (2.0, 5.0)     # spec 2.5-4.0
+# Coefficient of variation at which the pitch / width regularity scores reach zero
+MAX_PITCH_CV = 0.25
+MAX_WIDTH_CV = 0.6
+# Minimum share of bars reaching the top (F/A) and of bars reaching the bottom (F/D).
+# An IMB mixes all four bar states; a run of i/l/1 glyphs is one height throughout.
+MIN_STATE_SHARE = 0.1
+# Candidates scoring below this are not handed to the interpreter
+MIN_BARCODE_SCORE = 0.5
+
 def scale(roi):
     # Scale up the extracted barcode to be 500px tall while preserving the aspect ratio
     current_height = roi.shape[0]
@@ -79,69 +44,79 @@ def scale(roi):
     resized_roi = cv2.resize(roi, (new_width, 200), interpolation=cv2.INTER_LINEAR)
     return resized_roi
 
-def detect_vertical_lines(roi):
+def column_runs(binary_roi):
     """
-    Detects thin, barcode-like vertical lines in a given ROI.
-    
-    Parameters:
-        roi (np.array): Input region-of-interest image in BGR format.
-        
+    Runs of inked columns across the central tracker rows of a binarized (ink = white)
+    candidate, at its native resolution.
+
     Returns:
-        int: Count of detected vertical bars.
+        (starts, widths): NumPy arrays, one entry per run (bar), left to right.
     """
-    # Convert to grayscale and scale the ROI
-    roi = scale(roi)
-    roi_gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-    
-    # Apply a slight blur to reduce noise
-    blurred = cv2.medianBlur(roi_gray, 3)
-    
-    # Apply Otsu's thresholding with binary inversion
-    _, binary_roi = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-    
-    # Save the binary debug image
-    debug_bin_path = os.path.join(output_dir, f"bin_debug_{barcode_counter_final + 1}.png")
-    if DEBUG:
-        cv2.imwrite(debug_bin_path, binary_roi)
-    
-    # Enhance the thin vertical lines using morphological closing
-    vertical_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 5))
-    morph = cv2.morphologyEx(binary_roi, cv2.MORPH_CLOSE, vertical_kernel)
-    
-    # Save the morphological debug image
-    debug_morph_path = os.path.join(output_dir, f"morph_debug_{barcode_counter_final + 1}.png")
-    if DEBUG:
-        cv2.imwrite(debug_morph_path, morph)
-    
-    # Use connected components to identify candidate regions
-    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(morph, connectivity=8)
-    
-    bar_count = 0
-    debug_roi = roi.copy()
-    
-    # Loop over each detected component (skip background at index 0)
-    for i in range(1, num_labels):
-        x, y, w, h, area = stats[i]
-        # Define criteria for a thin vertical line
-        if h / w > 3:
-            bar_count += 1
-            cv2.rectangle(debug_roi, (x, y), (x + w, y + h), (0, 255, 0), 1)
-        else:
-            cv2.rectangle(debug_roi, (x, y), (x + w, y + h), (0, 0, 255), 1)
-    
-    # Save the final debug image with detected bars outlined
-    debug_roi_path = os.path.join(output_dir, f"debug_bbox_{barcode_counter_final + 1}.png")
-    if DEBUG:
-        cv2.imwrite(debug_roi_path, debug_roi)
+    h = binary_roi.shape[0]
+    top = int(h * TRACKER_BAND[0])
+    bottom = max(int(h * TRACKER_BAND[1]), top + 1)
+    inked = (binary_roi[top:bottom] > 0).mean(axis=0) >= 0.5
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], inked.astype(np.int8), [0]))))
+    starts, ends = edges[::2], edges[1::2]
+    return starts, ends - starts
 
+def _range_score(value, bounds):
+    """1 inside `bounds`, falling linearly to 0 at half the lower / 1.5x the upper bound."""
+    low, high = bounds
+    if value < low:
+        return max(0.0, (value - 0.5 * low) / (0.5 * low))
+    if value > high:
+        return max(0.0, 1.0 - (value - high) / (0.5 * high))
+    return 1.0
+
+def score_candidate(binary_roi):
     """
-    DEVNOTE: We should update this function so that, if the vertical lines are spaced to far apart (net), we reject the candidate.
-    Specifically, barcodes will be close together like ||||||. Sometimes, text will include i's and l's, and those are often detected as
-    vertical lines. So if we detect a lot of i's and l's, that can lead to a false positive on barcode detection. To prevent this, we need
-    to make sure that the vertical lines that ARE detected aren't too spread out. This is doable, I just got too lazy to code it :)
+    Scores how much a candidate looks like an IMB, from one column projection profile
+    (see column_runs) at native resolution. Candidates with a bar count out of range
+    (text lines, solid blocks) are rejected before any other statistics.
+
+    The score is the geometric mean of, each in [0, 1]:
+      - count: closeness of the bar count to 65,
+      - pitch: uniformity of the bar-to-bar spacing,
+      - width: consistency of the bar widths,
+      - spec:  bar width and full bar height as ratios of the pitch, against the IMB spec,
+      - states: bars reach both the top (F/A) and the bottom (F/D) in a mix, not all
+        alike, as in a line of i/l/1 glyphs.
+
+    Returns:
+        (bar_count, score)
     """
-    
-    return bar_count
+    starts, widths = column_runs(binary_roi)
+    bar_count = len(starts)
+    if bar_count < MIN_BARS or bar_count > MAX_BARS:
+        return bar_count, 0.0
+
+    pitches = np.diff(starts + widths / 2.0)
+    pitch = float(np.median(pitches))
+    count_score = max(0.0, 1.0 - abs(bar_count - 65) / 30.0)
+    pitch_score = max(0.0, 1.0 - float(np.std(pitches)) / pitch / MAX_PITCH_CV)
+    width_score = max(0.0, 1.0 - float(np.std(widths) / np.mean(widths)) / MAX_WIDTH_CV)
+
+    # Vertical extent of every bar: the inked rows of its columns, one reduceat for all
+    ink = (binary_roi > 0).astype(np.uint8)
+    bounds = np.column_stack((starts, starts + widths)).ravel()
+    if bounds[-1] == ink.shape[1]:
+        bounds = bounds[:-1]  # the last bar runs to the edge
+    bar_rows = np.add.reduceat(ink, bounds, axis=1)[:, ::2] > 0
+    tops = np.argmax(bar_rows, axis=0)
+    bottoms = ink.shape[0] - 1 - np.argmax(bar_rows[::-1], axis=0)
+    top, bottom = tops.min(), bottoms.max()
+    full_height = float(bottom - top + 1)
+    spec_score = min(_range_score(float(np.median(widths)) / pitch, WIDTH_TO_PITCH),
+                     _range_score(full_height / pitch, HEIGHT_TO_PITCH))
+
+    reach = full_height / 6.0
+    ascending = float(np.mean(tops <= top + reach))
+    descending = float(np.mean(bottoms >= bottom - reach))
+    state_score = min(1.0, min(ascending, 1.0 - ascending, descending, 1.0 - descending) / MIN_STATE_SHARE)
+
+    scores = np.array([count_score, pitch_score, width_score, spec_score, state_score])
+    return bar_count, float(np.prod(scores) ** (1.0 / len(scores)))
 
 def extract_roi_with_empty_padding(x, y, w, h, image, padding=PADDING):
     """
@@ -149,80 +124,174 @@ def extract_roi_with_empty_padding(x, y, w, h, image, padding=PADDING):
     If the padded area falls outside the image boundaries, those areas are filled with zeros.
     """
     img_h, img_w = image.shape[:2]
-    
+
     # Coordinates for the padded ROI (these may be negative)
     x1 = x - padding
     y1 = y - padding
     x2 = x + w + padding
     y2 = y + h + padding
-    
+
     out_w = w + 2 * padding
     out_h = h + 2 * padding
-    
+
     # Create an empty (zero-filled) canvas for the ROI
     if image.ndim == 3:
         roi = np.zeros((out_h, out_w, image.shape[2]), dtype=image.dtype)
     else:
         roi = np.zeros((out_h, out_w), dtype=image.dtype)
-    
+
     # Calculate the intersection between the padded ROI and the image boundaries
     src_x1 = max(x1, 0)
     src_y1 = max(y1, 0)
     src_x2 = min(x2, img_w)
     src_y2 = min(y2, img_h)
-    
+
     # Determine destination coordinates in the ROI where the image data should be placed
     dst_x1 = src_x1 - x1
     dst_y1 = src_y1 - y1
     dst_x2 = dst_x1 + (src_x2 - src_x1)
     dst_y2 = dst_y1 + (src_y2 - src_y1)
-    
+
     roi[dst_y1:dst_y2, dst_x1:dst_x2] = image[src_y1:src_y2, src_x1:src_x2]
     return roi
 
-for contour in contours_final:
-    x, y, w, h = cv2.boundingRect(contour)
-    aspect_ratio = w / float(h)
-
-    # Initial barcode-like shape filter
-    if w > 60 and h > 15 and 1.5 < aspect_ratio < 20.0:
-        # Extract padded ROI using the new function that leaves the padding empty (zeros)
-        roi = extract_roi_with_empty_padding(x, y, w, h, image, padding=PADDING)
-        
-        # Compute padded bounding box coordinates (without clipping)
-        x_pad = x - PADDING
-        y_pad = y - PADDING
-        w_pad = w + 2 * PADDING
-        h_pad = h + 2 * PADDING
-
-        # Ensure ROI has 3 channels before conversion
-        if len(roi.shape) == 2:
-            roi_gray = roi
-        else:
-            roi_gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+def extract_barcodes(image, debug=None):
+    """
+    Finds IMB-like barcodes in an in-memory envelope image.
+
+    Parameters:
+        image (np.array or EnvelopeImage): Envelope image (grayscale, or BGR which is
+            converted). Pass the envelope's EnvelopeImage to share its cached views.
+        debug (DebugContext): If given, the intermediate images of every step and the
+            accepted candidate crops are written into its scratch directory.
+
+    Returns:
+        A list of dictionaries, one per accepted barcode, with keys:
+           'index': Candidate number (matches the CLI's barcode_<index>.png),
+           'roi': The padded barcode, scaled to 200 px tall,
+           'roi_views': EnvelopeImage of 'roi' (hand it to the interpreter),
+           'bbox': The padded bounding box in `image` coordinates (x, y, w, h),
+           'bar_count': Number of vertical bars counted by score_candidate(),
+           'score': IMB likeness in [0, 1] (see score_candidate()).
+        Best-scoring barcodes first.
+    """
+    env = EnvelopeImage.wrap(image)
+    gray = env.view("gray")
+    # Bars are counted on the envelope's own Otsu binary, at native resolution
+    binary = env.view("binary")
+
+    # Step 1: Reduce noise and enhance barcode structure (7x7 Gaussian blur)
+    blurred_refined = env.view("blurred")
+
+    # Apply adaptive thresholding for better barcode contrast (17 px blocks, C=5, inverted)
+    thresh_refined = env.view("adaptive")
+
+    # Step 2: Use two-stage morphological operations
+
+    # First: Closing to connect barcode gaps
+    kernel_close = cv2.getStructuringElement(cv2.MORPH_RECT, (18, 6))
+    morph_closed = cv2.morphologyEx(thresh_refined, cv2.MORPH_CLOSE, kernel_close)
 
-        # Detect vertical bars in ROI
-        vertical_bar_count = detect_vertical_lines(roi)
-        
-        # Save debug image of the current candidate ROI
-        candidate_debug_path = os.path.join(output_dir, f"candidate_debug_{barcode_counter_final + 1}.png")
-        if DEBUG:
-            cv2.imwrite(candidate_debug_path, roi)
-        
-        barcode_counter_final += 1
+    # Second: Opening to remove small noise
+    kernel_open = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+    morph_refined = cv2.morphologyEx(morph_closed, cv2.MORPH_OPEN, kernel_open)
 
-        # Accept the candidate if it has enough vertical bars
-        if vertical_bar_count >= 35 and vertical_bar_count <= 66:
-            real_barcodes.append((x_pad, y_pad, w_pad, h_pad))
-            cv2.rectangle(filtered_visualization_final, (x_pad, y_pad), (x_pad + w_pad, y_pad + h_pad), (0, 0, 255), 2)
+    # Step 3: Find contours (Initial barcode candidates)
+    contours_final, _ = cv2.findContours(morph_refined, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
 
-            # Scale up the extracted barcode to be 500px tall while preserving aspect ratio
-            resized_barcode = scale(roi)
+    if debug is not None:
+        debug.save("0_blurred.png", blurred_refined)
+        debug.save("1_adaptive_threshold.png", thresh_refined)
+        debug.save("2_morphological_closing.png", morph_closed)
+        debug.save("3_morphological_opening.png", morph_refined)
+        # Draw contours on a colour copy for visualization
+        image_vis = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+        contour_visualization_final = image_vis.copy()
+        cv2.drawContours(contour_visualization_final, contours_final, -1, (0, 255, 0), 2)
+        debug.save("4_contour_detection.png", contour_visualization_final)
+        filtered_visualization_final = image_vis
+
+    # Step 4: Filter candidates using size, aspect ratio, and additional barcode detection methods
+    barcode_counter_final = 0
+    real_barcodes = []  # Store final valid barcodes
+
+    for contour in contours_final:
+        x, y, w, h = cv2.boundingRect(contour)
+        aspect_ratio = w / float(h)
+
+        # Initial barcode-like shape filter
+        if w > 60 and h > 15 and 1.5 < aspect_ratio < 20.0:
+            barcode_counter_final += 1
+
+            # Score the candidate from one column profile; text and blocks are rejected
+            # here, before any padding, scaling or debug output
+            vertical_bar_count, score = score_candidate(binary[y:y + h, x:x + w])
+            if DEBUG:
+                print(f"Candidate {barcode_counter_final}: {vertical_bar_count} bars, score {score:.2f}")
+            if score < MIN_BARCODE_SCORE:
+                continue
+
+            # Extract padded ROI using the new function that leaves the padding empty (zeros)
+            roi = extract_roi_with_empty_padding(x, y, w, h, gray, padding=PADDING)
+
+            # Compute padded bounding box coordinates (without clipping)
+            x_pad = x - PADDING
+            y_pad = y - PADDING
+            w_pad = w + 2 * PADDING
+            h_pad = h + 2 * PADDING
+
+            # Save debug image of the current candidate ROI
+            if debug is not None:
+                debug.save(f"candidate_debug_{barcode_counter_final}.png", roi)
+
+            # Scaled once, for the interpreter
+            roi_views = EnvelopeImage(scale(roi))
+            real_barcodes.append({
+                "index": barcode_counter_final,
+                "roi": roi_views.image,
+                "roi_views": roi_views,
+                "bbox": (x_pad, y_pad, w_pad, h_pad),
+                "bar_count": vertical_bar_count,
+                "score": score,
+            })
+            if debug is not None:
+                cv2.rectangle(filtered_visualization_final, (x_pad, y_pad),
+                              (x_pad + w_pad, y_pad + h_pad), (0, 0, 255), 2)
+
+    # Save final validated barcode detections
+    if debug is not None:
+        debug.save("5_candidates.png", filtered_visualization_final)
+
+    real_barcodes.sort(key=lambda barcode: barcode["score"], reverse=True)
+    return real_barcodes
+
+def main():
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Barcode detection script")
+    parser.add_argument("image_path", type=str, help="Path to the input image")
+    args = parser.parse_args()
+
+    # Validate image path
+    if not os.path.exists(args.image_path):
+        print(f"Error: The file '{args.image_path}' does not exist.")
+        exit(1)
+
+    # Ensure the preprocessing folder is clean before each run
+    for directory in [output_dir, barcode_dir]:
+        if os.path.exists(directory):
+            for file in os.listdir(directory):
+                os.remove(os.path.join(directory, file))
+        else:
+            os.makedirs(directory)
 
-            # Save extracted barcode as an individual image
-            barcode_path = os.path.join(barcode_dir, f"barcode_{barcode_counter_final}.png")
-            cv2.imwrite(barcode_path, resized_barcode)
+    # Load the image straight to grayscale; the pipeline is luma-only
+    image = cv2.imread(args.image_path, cv2.IMREAD_GRAYSCALE)
 
-# Save final validated barcode detections
-cv2.imwrite(os.path.join(output_dir, "5_candidates.png"), filtered_visualization_final)
+    # Save extracted barcodes as individual images
+    debug = DebugContext(os.path.basename(output_dir), root=os.path.dirname(output_dir), unique=False)
+    for barcode in extract_barcodes(image, debug=debug):
+        barcode_path = os.path.join(barcode_dir, f"barcode_{barcode['index']}.png")
+        cv2.imwrite(barcode_path, barcode["roi"])
 
+if __name__ == "__main__":
+    main()
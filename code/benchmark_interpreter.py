@@ -0,0 +1,129 @@
+'''
+Benchmark: the interpreter's NumPy candidate grouping and FADT classification
+(interpreter.candidate_stats / group_candidates / classify_bars) against the original
+per-candidate Python loops, on envelopes covered in text, where connected components
+produce thousands of bar-like candidates.
+
+Usage: python3 benchmark_interpreter.py [--lines 40] [--noise 3000] [--repeat 3]
+'''
+import argparse
+import random
+import cv2
+import numpy as np
+from benchmark_sharpness import _time
+from interpreter import candidate_stats, group_candidates, classify_bars
+from luma import CAPTURE_SIZE
+
+
+def legacy_candidates(binary):
+    """Candidate extraction as it was before (a list of tuples)."""
+    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    candidates = []
+    for i in range(1, num_labels):
+        x, y, w_box, h_box, area = stats[i]
+        if (h_box / float(w_box)) < 1.5:
+            continue
+        center_y = y + h_box / 2
+        candidates.append((x, y, w_box, h_box, center_y))
+    return candidates
+
+
+def legacy_group(candidates):
+    """Grouping as it was before: every candidate against every group's recomputed mean."""
+    groups = []
+    candidates.sort(key=lambda c: c[4])
+    y_threshold = 40
+    for cand in candidates:
+        assigned = False
+        for group in groups:
+            if abs(cand[4] - np.mean([c[4] for c in group])) < y_threshold:
+                group.append(cand)
+                assigned = True
+                break
+        if not assigned:
+            groups.append([cand])
+    return [g for g in groups if len(g) >= 30]
+
+
+def legacy_classify(group):
+    """Per-bar classification loop as it was before."""
+    group.sort(key=lambda c: c[0])
+    ys = [c[1] for c in group]
+    hs = [c[3] for c in group]
+    group_y_min = min(ys)
+    group_y_max = max([ys[i] + hs[i] for i in range(len(ys))])
+    group_height = group_y_max - group_y_min
+    mid = group_y_min + group_height / 2
+    tolerance = 15
+    pattern = ""
+    for (x, y, w_box, h_box, cy) in group:
+        top = y
+        bottom = y + h_box
+        if h_box < 0.3 * group_height:
+            label = "T"
+        elif top <= group_y_min + tolerance and bottom >= group_y_max - tolerance:
+            label = "F"
+        elif top <= group_y_min + tolerance and bottom > mid:
+            label = "A"
+        elif bottom >= group_y_max - tolerance and top < mid:
+            label = "D"
+        else:
+            label = "T"
+        pattern += label
+    return pattern
+
+
+def text_heavy_envelope(lines, noise, seed=0):
+    """
+    A binarized, Y-plane sized envelope full of small text (lots of i/l/1 strokes and
+    broken glyphs) plus speckle noise, with one IMB. Returns (binary, pattern).
+    The whole image goes through the interpreter, so text rows form groups of their own.
+    """
+    rng = random.Random(seed)
+    width, height = CAPTURE_SIZE
+    img = np.full((height, width), 255, dtype=np.uint8)
+    alphabet = "illi1 LIST Mill 1111 ilium HILL lilt 7Il1 "
+    line_height = max(12, (height - 120) // max(1, lines))
+    for k in range(lines):
+        text = "".join(rng.choice(alphabet) for _ in range(110))
+        cv2.putText(img, text, (10, 20 + k * line_height), cv2.FONT_HERSHEY_PLAIN, 1.0, 0, 1)
+    pattern = "".join(rng.choice("FADT") for _ in range(65))
+    x0, y0, pitch, full = 400, height - 80, 12, 48
+    for i, c in enumerate(pattern):
+        top = y0 if c in "FA" else y0 + full // 3
+        bottom = y0 + full if c in "FD" else y0 + 2 * full // 3
+        cv2.rectangle(img, (x0 + i * pitch, top), (x0 + i * pitch + 4, bottom), 0, -1)
+    np_rng = np.random.default_rng(seed)
+    xs = np_rng.integers(0, width - 2, noise)
+    ys = np_rng.integers(0, height - 6, noise)
+    for x, y in zip(xs, ys):
+        img[y:y + 5, x] = 0
+    _, binary = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return cv2.morphologyEx(binary, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (1, 5))), pattern
+
+
+def legacy_run(binary):
+    return [legacy_classify(g) for g in legacy_group(legacy_candidates(binary))]
+
+
+def vectorized_run(binary):
+    return [classify_bars(g) for g in group_candidates(candidate_stats(binary))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="IMB interpreter grouping/classification benchmark")
+    parser.add_argument("--lines", type=int, default=40, help="Lines of text on the envelope")
+    parser.add_argument("--noise", type=int, default=3000, help="Speckles (short vertical strokes)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per method (best is reported)")
+    args = parser.parse_args()
+
+    binary, _ = text_heavy_envelope(args.lines, args.noise)
+    print(f"{binary.shape[1]}x{binary.shape[0]} envelope, {len(candidate_stats(binary))} bar-like candidates")
+
+    legacy_time, legacy_patterns = _time(lambda: legacy_run(binary), args.repeat)
+    fast_time, fast_patterns = _time(lambda: vectorized_run(binary), args.repeat)
+
+    print(f"legacy loops  : {legacy_time * 1000:8.1f} ms  -> {len(legacy_patterns)} group(s)")
+    print(f"numpy sweep   : {fast_time * 1000:8.1f} ms  -> {len(fast_patterns)} group(s)")
+    print(f"same patterns : {legacy_patterns == fast_patterns}")
+    print(f"speedup       : {legacy_time / fast_time:8.1f}x")
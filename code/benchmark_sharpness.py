@@ -0,0 +1,77 @@
+'''
+Benchmark: batch, downsampled frame scoring (frame_selection.best_frame_index) against
+the original per-frame full-resolution helper from processPictures.
+
+Usage: python3 benchmark_sharpness.py [--frames 40] [--scale 0.25] [--repeat 3]
+'''
+import argparse
+import time
+import cv2
+import numpy as np
+from frame_selection import best_frame_index
+from luma import CAPTURE_SIZE
+
+
+def legacy_helper(array):
+    """The frame-selection helper as it was before batch scoring (kept for comparison)."""
+    allEdgeIntensity = []
+    for i in range(len(array)):
+        blurred = cv2.GaussianBlur(array[i], (3, 3), 0)
+        laplacian = cv2.Laplacian(blurred, cv2.CV_64F)
+        laplacian_abs = np.uint8(np.absolute(laplacian))
+        allEdgeIntensity.append([i, np.mean(laplacian_abs)])
+    ranged_images = sorted(allEdgeIntensity, key=lambda x: x[1], reverse=True)
+    return ranged_images[0][0]
+
+
+def synthetic_frames(count, seed=0):
+    """
+    A stack of Y-plane sized frames of the same textured scene under varying motion
+    blur. The frame with the least blur is the expected winner.
+    """
+    rng = np.random.default_rng(seed)
+    width, height = CAPTURE_SIZE
+    scene = np.full((height, width), 220, dtype=np.uint8)
+    for _ in range(400):
+        x, y = int(rng.integers(0, width - 200)), int(rng.integers(0, height - 40))
+        cv2.rectangle(scene, (x, y), (x + int(rng.integers(2, 200)), y + int(rng.integers(2, 40))),
+                      int(rng.integers(0, 120)), -1)
+    blur = rng.integers(1, 25, size=count)
+    sharpest = int(rng.integers(0, count))
+    blur[sharpest] = 0
+    frames = np.empty((count, height, width), dtype=np.uint8)
+    for i, amount in enumerate(blur):
+        if amount == 0:
+            frames[i] = scene
+        else:
+            kernel = np.full((1, int(amount) + 1), 1.0 / (int(amount) + 1), dtype=np.float32)
+            frames[i] = cv2.filter2D(scene, -1, kernel)
+    return frames, sharpest
+
+
+def _time(fn, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Frame sharpness scoring benchmark")
+    parser.add_argument("--frames", type=int, default=40, help="Frames per capture window")
+    parser.add_argument("--scale", type=float, default=0.25, help="Thumbnail scale factor")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per method (best is reported)")
+    args = parser.parse_args()
+
+    frames, expected = synthetic_frames(args.frames)
+    print(f"{args.frames} frames of {frames.shape[2]}x{frames.shape[1]}, sharpest is #{expected}")
+
+    legacy_time, legacy_idx = _time(lambda: legacy_helper(frames), args.repeat)
+    batch_time, batch_idx = _time(lambda: best_frame_index(frames, scale=args.scale), args.repeat)
+
+    print(f"legacy helper : {legacy_time * 1000:8.1f} ms  -> frame #{legacy_idx}")
+    print(f"batch scorer  : {batch_time * 1000:8.1f} ms  -> frame #{batch_idx}")
+    print(f"speedup       : {legacy_time / batch_time:8.1f}x")
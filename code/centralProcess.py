@@ -1,12 +1,17 @@
-from processPictures import processPictures as process_pictures
-from takePictures import capture_and_save as capture_and_save_image
-from takePictures import start_continuous_capture
-from envelope_processor import envelopeProcessTrigger as process_envelope
+from processPictures import select_frames
+from takePictures import start_continuous_capture, capture_frames
+from envelope_processor import process_envelopes, process_envelopes_barcode_only
+from frame_container import open_frames, camera_frames
+from pipeline import Pipeline, Stage, AuditWriter, BLOCK, DROP_OLDEST, DEGRADE
+from scheduling import apply_to_current_thread
+from ocr_engine import warm_up as warm_up_ocr
+from uploader import Uploader
 
 import os
 import threading
 import time
-import psutil
+import uuid
+import cv2
 import logging
 import queue
 import keyboard  # pip install keyboard
@@ -15,9 +20,48 @@ from watchdog.events import FileSystemEventHandler
 
 import socketserver
 
+# Directory the pipeline's audit side-channel persists stage outputs to (for audit and
+# replay), or None to keep everything in memory.
+AUDIT_DIR = "./audit"
+AUDIT_STAGES = ("select", "envelope")
+
+# CPU placement (Pi 5: cores 0-3). The camera ring writers get a core of their own and
+# the highest priority so OCR load can never make them drop frames; the capture window
+# (streaming frame scoring) and frame selection share core 1; OCR/barcode workers get
+# cores 2-3 at a low priority. Negative nice values need CAP_SYS_NICE (run as root).
+CPU_PLAN = {
+    "camera":   {"cores": [0], "nice": -10},
+    "capture":  {"cores": [1], "nice": -5},
+    "select":   {"cores": [1], "nice": 0},
+    "envelope": {"cores": [2, 3], "nice": 10},
+}
+
+# Per-stage concurrency and overload behaviour:
+#   workers       - items processed concurrently by the stage
+#   use_processes - run the stage in a pool of worker processes (uses the other cores)
+#   queue_size    - bounded input queue in front of the stage
+#   overload      - BLOCK (stall the producer; for "capture" that is the trigger),
+#                   DROP_OLDEST (discard the oldest queued item) or
+#                   DEGRADE (envelope only: fall back to barcode-only while backed up)
+#   cpu_plan      - cores and nice value for the stage's threads/worker processes
+#                   (see CPU_PLAN)
+STAGE_CONFIG = {
+    "capture":  {"workers": 1, "use_processes": False, "queue_size": 4, "overload": BLOCK,
+                 "cpu_plan": CPU_PLAN["capture"]},
+    "select":   {"workers": 1, "use_processes": True, "queue_size": 4, "overload": DROP_OLDEST,
+                 "cpu_plan": CPU_PLAN["select"]},
+    "envelope": {"workers": 2, "use_processes": True, "queue_size": 4, "overload": DEGRADE,
+                 "cpu_plan": CPU_PLAN["envelope"]},
+}
+
+# The running capture -> select -> envelope pipeline (created in main)
+pipeline = None
+
 class EventHandler(socketserver.BaseRequestHandler):
     def handle(self):
-        capture_and_save_image()
+        # Stamp the trigger time now; the capture stage reads the frames from the camera
+        # rings starting at this moment even if it picks the request up a little later.
+        pipeline.submit({"uuid": str(uuid.uuid4()), "trigger_time": time.monotonic()})
 
 # Configure logging
 logging.basicConfig(filename='thread_monitor.log', level=logging.INFO,
@@ -51,7 +95,7 @@ class FolderBasedFileHandler(FileSystemEventHandler):
         if func:
             logging.info(f"Calling function '{func.__name__}' for file: {file_path}")
             try:
-                # Both process_pictures and process_envelope expect a file path.
+                # The mapped functions expect a file path.
                 func(file_path)
             except Exception as e:
                 logging.error(f"Error executing '{func.__name__}' on file '{file_path}': {e}")
@@ -64,16 +108,9 @@ def start_thread(target, name, priority=None, cpu_affinity=None):
     Use this for functions that run continuously and do not require an external argument.
     """
     def wrapped_target():
-        tid = threading.get_ident()
-        time.sleep(0.1)  # Allow thread initialization.
-        try:
-            p = psutil.Process(tid)
-            if priority is not None:
-                p.nice(priority)
-            if cpu_affinity is not None:
-                p.cpu_affinity(cpu_affinity)
-        except psutil.NoSuchProcess:
-            logging.warning(f"Could not set affinity/priority for {name}")
+        # Affinity and nice are per-thread on Linux, so they are applied from inside the
+        # thread to its native id (threading.get_ident() is not an OS thread id).
+        apply_to_current_thread(name, cpu_affinity, priority)
         target()  # Call the target function.
         
     thread = threading.Thread(target=wrapped_target, name=name, daemon=True)
@@ -124,20 +161,69 @@ def watchdog():
         else:
             logging.error(f"No restart mapping defined for thread: {crashed_thread}")
 
+def build_pipeline():
+    """
+    Capture -> frame selection -> envelope processing, connected by bounded in-memory
+    queues. Frames and images are handed over as NumPy arrays; disk is only touched by
+    the optional audit side-channel.
+    """
+    audit = AuditWriter(AUDIT_DIR, AUDIT_STAGES) if AUDIT_DIR else None
+    # OCR engines are loaded up front: in each envelope worker process as it starts, or
+    # here when the envelope stage runs in threads.
+    if not STAGE_CONFIG["envelope"]["use_processes"]:
+        warm_up_ocr(STAGE_CONFIG["envelope"]["workers"])
+    return Pipeline([
+        Stage("capture", capture_frames, **STAGE_CONFIG["capture"]),
+        Stage("select", select_frames, **STAGE_CONFIG["select"]),
+        Stage("envelope", process_envelopes, degraded_func=process_envelopes_barcode_only,
+              initializer=warm_up_ocr, **STAGE_CONFIG["envelope"]),
+    ], audit=audit)
+
+def replay_container(file_path):
+    """Feeds a frame container dropped into ./cache1 into the pipeline's select stage."""
+    header, records = open_frames(file_path)
+    frames = {"camera0": camera_frames(records, 0), "camera1": camera_frames(records, 1)}
+    pipeline.submit({"uuid": header["uuid"], "frames": frames}, stage="select")
+
+def replay_image(file_path):
+    """Feeds an envelope image dropped into ./cache2 into the pipeline's envelope stage."""
+    image = cv2.imread(file_path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        logging.error(f"Could not read replay image {file_path}")
+        return
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    pipeline.submit({"uuid": name, "images": {"camera0": image}}, stage="envelope")
+
 def main():
+    global pipeline
     logging.info("Starting main thread manager...")
 
     server = socketserver.UDPServer(("localhost", 9999), EventHandler)
 
-    # Map each folder to the function that should process new files.
+    # Start the pipeline, and with it the stage worker processes. They are forked from
+    # a parent that already has threads: importing takePictures opened and started both
+    # cameras, and a pool that loses a worker is forked again later, from the running
+    # daemon (see pipeline.Stage._start_executor). Starting it before the capture
+    # threads, the uploader and the folder monitor only keeps those out of the first fork.
+    pipeline = build_pipeline()
+    pipeline.start()
+
+    # Drains the result spool (./outbox) to the server in the background
+    Uploader().start()
+
+    # Replay: frame containers dropped into ./cache1 and images dropped into ./cache2
+    # (e.g. copied from the audit directory) are still processed from disk.
+    os.makedirs("./cache1", exist_ok=True)
+    os.makedirs("./cache2", exist_ok=True)
+    # The handlers only enqueue work, so the observer thread never waits on processing.
     folder_function_map = {
-        os.path.abspath("./cache1"): process_pictures,   # Files here will be processed by process_pictures(file_path)
-        os.path.abspath("./cache2"): process_envelope,     # Files here will be processed by process_envelope(file_path)
+        os.path.abspath("./cache1"): replay_container,   # Frame containers go to the select stage
+        os.path.abspath("./cache2"): replay_image,       # Envelope images go to the envelope stage
     }
     # Start monitoring the folders.
     start_folder_monitor(folder_function_map)
 
-    start_continuous_capture()
+    start_continuous_capture(CPU_PLAN["camera"])
     # Optionally start a watchdog thread to restart any crashed continuous threads.
     threading.Thread(target=watchdog, name="WatchdogThread", daemon=True).start()
 
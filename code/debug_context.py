@@ -0,0 +1,59 @@
+import itertools
+import os
+import threading
+import time
+import cv2
+
+# Per-envelope debug output. Every envelope (every call) that wants debug images gets a
+# DebugContext of its own, writing into a scratch directory nobody else writes to, so
+# envelopes processed concurrently in threads or processes never overwrite each other's
+# images. Nothing is created on disk until the first image is saved.
+
+DEBUG_ROOT = "./debug"
+
+_counter = itertools.count()
+
+
+def _unique_name():
+    # Time first so directories sort in processing order; pid, thread and counter keep
+    # names unique across worker processes and threads
+    return (f"{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_"
+            f"{threading.get_ident() % 100000}_{next(_counter)}")
+
+
+class DebugContext:
+    """
+    A scratch directory for one envelope's debug images.
+
+    Parameters:
+        name (str): Directory name under `root` (e.g. the envelope's uuid). A unique
+            name is generated when omitted.
+        root (str): Parent directory.
+        unique (bool): Append a unique suffix to `name`, so the same envelope processed
+            twice (or two envelopes with the same name) never share a directory.
+    """
+
+    def __init__(self, name=None, root=DEBUG_ROOT, unique=True):
+        if name is None:
+            name = _unique_name()
+        elif unique:
+            name = f"{name}_{_unique_name()}"
+        self.directory = os.path.join(root, name)
+        self._created = False
+
+    def path(self, filename):
+        """Path of `filename` in the scratch directory (which is created on first use)."""
+        if not self._created:
+            os.makedirs(self.directory, exist_ok=True)
+            self._created = True
+        return os.path.join(self.directory, filename)
+
+    def save(self, filename, image):
+        """Writes a debug image into the scratch directory and returns its path."""
+        path = self.path(filename)
+        cv2.imwrite(path, image)
+        return path
+
+    def child(self, name):
+        """A context for a sub-step (e.g. a fallback image), in a subdirectory of this one."""
+        return DebugContext(name, root=self.directory, unique=False)
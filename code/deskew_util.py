@@ -1,72 +1,105 @@
+import sys
 import numpy as np
 import cv2
+from luma import to_gray
 
-def get_normalized_image(path):
-    img = cv2.imread(path)
-    resized_height = 480
-    percent = resized_height / len(img)
-    resized_width = int(percent * len(img[0]))
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    gray = cv2.GaussianBlur(gray, (9, 9), 0)
-    cv2.imwrite("blur.jpg",gray)
-    gray = cv2.resize(gray,(resized_width,resized_height))
-    cv2.imwrite("resized.jpg",gray)
-    try:
-        start_point = (0, 0) 
-        end_point = (gray.shape[0], gray.shape[1]) 
-        color = (255, 255, 255) 
-        thickness = 10
-        gray = cv2.rectangle(gray, start_point, end_point, color, thickness) 
-        cv2.imwrite("cropped.jpg",gray)
-    except:
-        print("Failed to crop border")
-    gray = cv2.bitwise_not(gray)
-    cv2.imwrite("inverted.jpg",gray)
-    
-    return gray
-    
-def get_skew_angle(gray):
-    thresh = cv2.threshold(gray, 0, 255,
-        cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (30, 5))
-    cv2.imwrite("thresh.jpg",thresh)
-    dilate = cv2.dilate(thresh, kernel)
-    contours, hierarchy = cv2.findContours(dilate, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-
-    angles = []
-    for contour in contours:
-        minAreaRect = cv2.minAreaRect(contour)
-        angle = minAreaRect[-1]
-        if angle != 90.0 and angle != -0.0:
-            angles.append(angle)
-        
-    angles.sort()
-    mid_angle = angles[int(len(angles)/2)]
-    print(angles)
-    print(mid_angle)
-    #cv2.namedWindow('dilate',cv2.WINDOW_NORMAL)
-    #cv2.imshow("dilate", dilate)
-    cv2.imwrite("dilate.jpg",dilate)
-    return mid_angle
-
-def deskew(path):
-    original = cv2.imread(path)
-    img = get_normalized_image(path)
-    angle = get_skew_angle(img)
-    #angle = np.rad2deg(angle)
-    print(angle)
-    if angle > 45: #anti-clockwise
-        angle = -(90 - angle)
-    height = original.shape[0]
-    width = original.shape[1]
+# Skew estimation by projection profile: the ink of horizontal text lines (and the IMB)
+# piles up in a few rows only when the image is rotated back by the right angle. All
+# the work happens on a small binarized copy, and every candidate angle is scored at
+# once with NumPy, so no contours are traced and nothing is written to disk.
+
+SKEW_HEIGHT = 480          # height of the working copy
+MAX_SKEW = 15.0            # degrees searched either way
+COARSE_STEP = 0.5          # degrees
+FINE_STEP = 0.05           # degrees
+MAX_POINTS = 20000         # ink pixels sampled for the profile
+ANGLE_TOLERANCE = 0.3      # degrees; below this the image is not rotated at all
+MIN_CONFIDENCE = 0.1       # below this the estimate is not trusted
+BORDER = 10                # pixels of the working copy ignored at the edges (frame edges)
+
+
+def _ink_points(gray, height=SKEW_HEIGHT):
+    """Downsamples first, then binarizes. Returns the (x, y) ink coordinates, centred."""
+    gray = to_gray(gray)
+    scale = height / float(gray.shape[0])
+    small = cv2.resize(gray, (max(1, int(gray.shape[1] * scale)), height), interpolation=cv2.INTER_AREA)
+    _, ink = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    ink[:BORDER, :] = 0
+    ink[-BORDER:, :] = 0
+    ink[:, :BORDER] = 0
+    ink[:, -BORDER:] = 0
+    ys, xs = np.nonzero(ink)
+    if len(xs) > MAX_POINTS:
+        keep = np.random.default_rng(0).choice(len(xs), MAX_POINTS, replace=False)
+        xs, ys = xs[keep], ys[keep]
+    h, w = small.shape
+    return xs.astype(np.float32) - w / 2.0, ys.astype(np.float32) - h / 2.0, h + w
+
+
+def _profile_scores(xs, ys, angles, bins):
+    """
+    Projection-profile score (sum of squared row counts) for every angle in `angles`,
+    computed in one pass: each point's row after rotating by each angle, then one
+    bincount over all (angle, row) pairs.
+    """
+    theta = np.deg2rad(angles).astype(np.float32)
+    rows = ys[:, None] * np.cos(theta) - xs[:, None] * np.sin(theta)
+    rows = np.clip(np.rint(rows).astype(np.int64) + bins // 2, 0, bins - 1)
+    flat = rows + np.arange(len(angles)) * bins
+    counts = np.bincount(flat.ravel(), minlength=len(angles) * bins).reshape(len(angles), bins)
+    counts = counts.astype(np.float64)
+    return (counts * counts).sum(axis=1)
+
+
+def estimate_skew(gray):
+    """
+    Estimates the skew of an envelope image within +/- MAX_SKEW degrees.
+
+    Returns:
+        (angle, confidence): `angle` in degrees, in cv2.getRotationMatrix2D's convention
+        (the rotation that straightens the image). `confidence` is in [0, 1]: how much
+        the best angle's profile stands out from the others; 0 when there is no ink.
+    """
+    xs, ys, bins = _ink_points(gray)
+    if len(xs) < 100:
+        return 0.0, 0.0
+
+    coarse = np.arange(-MAX_SKEW, MAX_SKEW + COARSE_STEP / 2, COARSE_STEP)
+    coarse_scores = _profile_scores(xs, ys, coarse, bins)
+    best = coarse[np.argmax(coarse_scores)]
+
+    fine = np.arange(best - COARSE_STEP, best + COARSE_STEP + FINE_STEP / 2, FINE_STEP)
+    fine_scores = _profile_scores(xs, ys, fine, bins)
+    angle = float(fine[np.argmax(fine_scores)])
+
+    peak = fine_scores.max()
+    confidence = float((peak - np.median(coarse_scores)) / peak) if peak > 0 else 0.0
+    return angle, confidence
+
+
+def deskew(original, tolerance=ANGLE_TOLERANCE, min_confidence=MIN_CONFIDENCE):
+    """
+    Straightens an envelope image.
+
+    The warp is skipped entirely (the input is returned as is) when the angle is below
+    `tolerance` or the estimate's confidence is below `min_confidence`.
+
+    Returns:
+        (deskewed, angle, confidence): `angle` is the rotation applied (0.0 if none).
+    """
+    angle, confidence = estimate_skew(original)
+    if abs(angle) < tolerance or confidence < min_confidence:
+        return original, 0.0, confidence
+    height, width = original.shape[:2]
     m = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1)
-    
-    #deskewed = cv2.warpAffine(original, m, (width, height), borderMode=cv2.BORDER_REPLICATE)
-    deskewed = cv2.warpAffine(original, m, (width, height), borderValue=(255,255,255))
-    #cv2.namedWindow('deskewed',cv2.WINDOW_NORMAL)
-    #cv2.imshow("deskewed", deskewed)
-    #cv2.namedWindow('original',cv2.WINDOW_NORMAL)
-    #cv2.imshow("original", original)
-    #cv2.waitKey(0)
-    return deskewed
+    border = 255 if original.ndim == 2 else (255, 255, 255)
+    deskewed = cv2.warpAffine(original, m, (width, height), flags=cv2.INTER_LINEAR, borderValue=border)
+    return deskewed, angle, confidence
+
 
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python deskew_util.py <path_to_image>")
+        sys.exit(1)
+    angle, confidence = estimate_skew(cv2.imread(sys.argv[1], cv2.IMREAD_GRAYSCALE))
+    print(f"skew {angle:.2f} deg, confidence {confidence:.2f}")
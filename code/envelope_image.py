@@ -0,0 +1,108 @@
+import threading
+import cv2
+from luma import to_gray
+
+# Derived views of one envelope image, computed on first use and cached. Every stage
+# (barcode extraction, band localization, address layout, OCR, the interpreter) asks
+# for the views it needs by name, so each transform runs at most once per envelope and
+# views nobody asks for are never computed.
+
+
+def _gray(env):
+    return to_gray(env.image)
+
+
+def _blurred(env):
+    return cv2.GaussianBlur(env.view("gray"), (7, 7), 0)
+
+
+def _adaptive(env):
+    # Dark detail (bars, text) as white, for barcode candidate detection
+    return cv2.adaptiveThreshold(env.view("blurred"), 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                 cv2.THRESH_BINARY_INV, 17, 5)
+
+
+def _binary(env):
+    _, binary = cv2.threshold(env.view("gray"), 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return binary
+
+
+def _denoised(env):
+    return cv2.medianBlur(env.view("gray"), 3)
+
+
+def _denoised_binary(env):
+    _, binary = cv2.threshold(env.view("denoised"), 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return binary
+
+
+def _half(env):
+    return cv2.resize(env.view("gray"), None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
+
+
+def _quarter(env):
+    return cv2.resize(env.view("half"), None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
+
+
+# name -> function(EnvelopeImage) building the view (it may ask for other views)
+VIEWS = {
+    "gray": _gray,                        # single channel
+    "blurred": _blurred,                  # 7x7 Gaussian
+    "adaptive": _adaptive,                # adaptive threshold of "blurred", inverted
+    "binary": _binary,                    # Otsu of "gray", inverted
+    "denoised": _denoised,                # 3x3 median
+    "denoised_binary": _denoised_binary,  # Otsu of "denoised", inverted
+    "half": _half,                        # pyramid level 1 (INTER_AREA)
+    "quarter": _quarter,                  # pyramid level 2
+}
+
+_LEVELS = {1.0: "gray", 0.5: "half", 0.25: "quarter"}
+
+
+class EnvelopeImage:
+    """
+    An envelope image plus its lazily computed, cached derived views.
+    Views are shared between threads (the barcode and OCR branches) and must be
+    treated as read-only.
+    """
+
+    def __init__(self, image):
+        self.image = image
+        self._views = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def wrap(cls, image):
+        """Returns `image` if it already is an EnvelopeImage, else a new one around it."""
+        return image if isinstance(image, cls) else cls(image)
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+    def view(self, name):
+        """The named view (see VIEWS), computed on first use."""
+        view = self._views.get(name)
+        if view is None:
+            with self._lock:
+                view = self._views.get(name)
+                if view is None:
+                    view = VIEWS[name](self)
+                    self._views[name] = view
+        return view
+
+    def scaled(self, scale):
+        """The grayscale view at `scale`; the pyramid levels are shared, others cached too."""
+        name = _LEVELS.get(scale)
+        if name is not None:
+            return self.view(name)
+        key = f"scale_{scale}"
+        with self._lock:
+            if key not in self._views:
+                self._views[key] = cv2.resize(self.view("gray"), None, fx=scale, fy=scale,
+                                              interpolation=cv2.INTER_AREA)
+            return self._views[key]
+
+    def computed(self):
+        """Names of the views computed so far (for debugging)."""
+        return list(self._views)
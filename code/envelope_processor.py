@@ -1,178 +1,136 @@
 import os
 import cv2
 import numpy as np
-import pytesseract
+import ocr_engine
 import re
 import sys
-import subprocess
 from tabulate import tabulate
-from interpreter import extract_all_imb
-import requests
+from interpreter import extract_all_imb, classify_bars
+from imb_decoder import decode_batch
+from barcode_extraction import extract_barcodes
+from barcode_band import locate_barcode_band
+from address_layout import address_crops
+from luma import to_gray
+from deskew_util import deskew
+from envelope_image import EnvelopeImage
+from debug_context import DebugContext
+import uploader
 import time
+import threading
 import datetime
-# This should be in a debug libray but I'm lazy
-OUTPUT_DIR = "./out"
-DEBUG_DIR = "./debug"
-BARCODE_DIR = "./barcodes"
-for folder in [OUTPUT_DIR, DEBUG_DIR, BARCODE_DIR]:
-    os.makedirs(folder, exist_ok=True)
-
+import concurrent.futures
+# When True, every envelope gets a debug_context.DebugContext: a scratch directory of its
+# own under debug_context.DEBUG_ROOT for its intermediate images. Nothing else in this
+# module (or the modules it calls) keeps per-envelope state outside the call, so
+# envelopes can be processed from many threads or processes at once.
 DEBUG = False
 
-def save_debug_image(filename, image, force=False):
-    """Helper to save images into the debug folder."""
-    global DEBUG
-    if (DEBUG or force):
-        cv2.imwrite(os.path.join(DEBUG_DIR, filename), image)
-
-    return os.path.join(DEBUG_DIR, filename)
-
-def save_output_image(filename, image):
-    """Helper to save images into the output folder."""
-    cv2.imwrite(os.path.join(OUTPUT_DIR, filename), image)
-
-# End of what should be in the debug library :)
-
-def get_normalized_image(original):
-    resized_height = 480
-    percent = resized_height / len(original)
-    resized_width = int(percent * len(original[0]))
-    gray = cv2.cvtColor(original, cv2.COLOR_BGR2GRAY)
-    gray = cv2.GaussianBlur(gray, (9, 9), 0)
-    cv2.imwrite("blur.jpg",gray)
-    gray = cv2.resize(gray,(resized_width,resized_height))
-    cv2.imwrite("resized.jpg",gray)
-    try:
-        start_point = (0, 0) 
-        end_point = (gray.shape[0], gray.shape[1]) 
-        color = (255, 255, 255) 
-        thickness = 10
-        gray = cv2.rectangle(gray, start_point, end_point, color, thickness) 
-        cv2.imwrite("cropped.jpg",gray)
-    except:
-        print("Failed to crop border")
-    gray = cv2.bitwise_not(gray)
-    cv2.imwrite("inverted.jpg",gray)
-    
-    return gray
-    
-def get_skew_angle(gray):
-    thresh = cv2.threshold(gray, 0, 255,
-        cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (30, 5))
-    cv2.imwrite("thresh.jpg",thresh)
-    dilate = cv2.dilate(thresh, kernel)
-    contours, hierarchy = cv2.findContours(dilate, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-
-    angles = []
-    for contour in contours:
-        minAreaRect = cv2.minAreaRect(contour)
-        angle = minAreaRect[-1]
-        if angle != 90.0 and angle != -0.0:
-            angles.append(angle)
-        
-    angles.sort()
-    mid_angle = angles[int(len(angles)/2)]
-    print(angles)
-    print(mid_angle)
-    #cv2.namedWindow('dilate',cv2.WINDOW_NORMAL)
-    #cv2.imshow("dilate", dilate)
-    cv2.imwrite("dilate.jpg",dilate)
-    return mid_angle
-
-def deskew(original, img):
-    angle = get_skew_angle(img)
-    #angle = np.rad2deg(angle)
-    print(angle)
-    if angle > 45: #anti-clockwise
-        angle = -(90 - angle)
-    height = original.shape[0]
-    width = original.shape[1]
-    m = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1)
-    
-    #deskewed = cv2.warpAffine(original, m, (width, height), borderMode=cv2.BORDER_REPLICATE)
-    deskewed = cv2.warpAffine(original, m, (width, height), borderValue=(255,255,255))
-    #cv2.namedWindow('deskewed',cv2.WINDOW_NORMAL)
-    #cv2.imshow("deskewed", deskewed)
-    #cv2.namedWindow('original',cv2.WINDOW_NORMAL)
-    #cv2.imshow("original", original)
-    #cv2.waitKey(0)
-    return deskewed
+# Per-envelope branches (barcode/IMB and OCR) run concurrently on this shared executor.
+# OpenCV and Tesseract spend most of their time outside the GIL, so threads are enough.
+BRANCH_WORKERS = 2
+BARCODE_BRANCH_TIMEOUT = 15.0  # seconds
+OCR_BRANCH_TIMEOUT = 30.0      # seconds
+
+# OCR only the likely address blocks (see address_layout) instead of the whole envelope
+ADDRESS_ROI_OCR = True
+
+# Fallbacks for a barcode whose read does not decode, tried in order (cheapest first)
+# until one does. Every barcode entry records the rung that decoded it in "Rung".
+#   "ambiguous_bars" - the least confident bars, one at a time, in their other likely state
+#   "tolerance"      - the bars reclassified with a tolerance relative to the bar height
+#   "denoised"       - the interpreter again, on the median-filtered binarization
+READ_LADDER = ("ambiguous_bars", "tolerance", "denoised")
+# Other images of the envelope read, in order, when no barcode of the best frame decodes
+#   "next_frame"     - the first camera's next-best frames
+#   "other_camera"   - the best frames of the other cameras (their address is OCRed when
+#                      the IMB is read from them: both are on the face that camera saw)
+IMAGE_LADDER = ("next_frame", "other_camera")
+AMBIGUOUS_CONFIDENCE = 0.5  # bars below this are retried in their other state
+MAX_AMBIGUOUS_BARS = 4      # single substitutions only, to keep chance CRC passes rare
+
+class _BranchExecutor(concurrent.futures.ThreadPoolExecutor):
+    """
+    Thread pool whose futures record when they started running (future.started, an
+    Event with the start time in .at). The pool is shared by every envelope processed
+    in this process, so a branch can wait in its queue behind other envelopes' branches;
+    timeouts only count from the start.
+    """
+    def submit(self, fn, *args, **kwargs):
+        started = threading.Event()
+        def run():
+            started.at = time.monotonic()
+            started.set()
+            return fn(*args, **kwargs)
+        future = super().submit(run)
+        future.started = started
+        return future
+
+_branch_executor = _BranchExecutor(max_workers=BRANCH_WORKERS, thread_name_prefix="EnvelopeBranch")
 
 def load_and_preprocess(image_path):
     """
-    Loads the image and applies several pre‑processing steps:
-      - Converts to grayscale.
-      - Applies Gaussian blur to reduce noise.
-      - Uses histogram equalization to boost contrast.
-      - Applies both Otsu thresholding (simple) and adaptive thresholding.
-    Saves intermediate images for debugging.
-    
-    Returns:
-      image_color: Original/resized color image (for barcode detection and OCR).
-      equalized: Blurred and equalized grayscale image.
-      thresh_adaptive: Adaptive thresholded image.
+    Loads the image at `image_path` as grayscale and runs preprocess() on it.
+    Returns the EnvelopeImage.
     """
-    original = cv2.imread(image_path)
-    img = get_normalized_image(original)
-    deskewed = deskew(original=original, img=img)
-    if deskewed is None:
+    original = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if original is None:
         print(f"Error: Unable to load image at {image_path}")
         sys.exit(1)
+    return preprocess(original)
 
-    height, width = deskewed.shape[:2]
+def preprocess(original):
+    """
+    Takes a grayscale envelope image (captures are already luma-only), resizes it to at
+    most 1600 px and straightens it (see deskew_util; skipped when it is already level).
+
+    Returns:
+      An EnvelopeImage of the deskewed image. Every later step asks it for the derived
+      views it needs (gray, blurred, binary, ...), each computed once, on first use.
+    """
+    # Resize before deskewing so the rotation (when one is needed at all) is cheaper
+    height, width = original.shape[:2]
     max_dim = 1600
     if max(height, width) > max_dim:
         scale = max_dim / float(max(height, width))
-        deskewed = cv2.resize(deskewed, (int(width * scale), int(height * scale)))
-    
-    image_gray = cv2.cvtColor(deskewed, cv2.COLOR_BGR2GRAY)
-    blurred = cv2.GaussianBlur(image_gray, (5, 5), 0)
-    equalized = cv2.equalizeHist(blurred)
-    
-    _, thresh_simple = cv2.threshold(equalized, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    thresh_adaptive = cv2.adaptiveThreshold(equalized, 255,
-                                            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                            cv2.THRESH_BINARY, 11, 2)
-    
-    save_debug_image("debug_gray.jpg", image_gray)
-    save_debug_image("debug_blurred.jpg", blurred)
-    save_debug_image("debug_equalized.jpg", equalized)
-    save_debug_image("debug_thresh_simple.jpg", thresh_simple)
-    save_debug_image("debug_thresh_adaptive.jpg", thresh_adaptive)
-    
-    return deskewed, equalized, thresh_adaptive
+        original = cv2.resize(original, (int(width * scale), int(height * scale)))
 
-def detect_barcodes(image):
+    deskewed, angle, confidence = deskew(original)
+    if DEBUG:
+        print(f"Deskew: rotated {angle:.2f} deg (confidence {confidence:.2f})")
+
+    return EnvelopeImage(to_gray(deskewed))
+
+def detect_barcodes(image, debug=None):
     """
     Detects standard barcodes in the provided image using pyzbar.
     (Note: pyzbar does not support IMB decoding.)
-    Returns a list of dictionaries with barcode data.
+    Returns a list of dictionaries with barcode data. With a `debug` DebugContext the
+    detections are drawn (on a copy) into its barcodes.jpg.
     """
     from pyzbar import pyzbar
     barcodes = pyzbar.decode(image)
     results = []
+    annotated = image.copy()
     for barcode in barcodes:
         (x, y, w, h) = barcode.rect
         barcode_data = barcode.data.decode("utf-8")
         barcode_type = barcode.type
-        cv2.rectangle(image, (x, y), (x + w, y + h), (0, 255, 0), 2)
+        cv2.rectangle(annotated, (x, y), (x + w, y + h), (0, 255, 0), 2)
         results.append({
             "data": barcode_data,
             "type": barcode_type,
             "rect": (x, y, w, h)
         })
-    save_output_image("debug_barcodes.jpg", image)
+    if debug is not None:
+        debug.save("barcodes.jpg", annotated)
     return results
 
 def perform_ocr(image):
     """
     Uses Tesseract OCR to extract text from the image.
-    Uses a custom configuration to improve layout detection.
+    Runs on this process's pool of warm engines (--oem 3 --psm 6, eng), see ocr_engine.
     """
-    custom_config = r'--oem 3 --psm 6'
-    text = pytesseract.image_to_string(image, config=custom_config, lang='eng')
-    return text
+    return ocr_engine.image_to_string(image)
 
 def extract_pii(text):
     """
@@ -214,74 +172,230 @@ def extract_pii(text):
 
     return results
 
-def run_barcode_extraction(image_path):
-    """
-    Calls the barcode_extraction.py script as a subprocess.
-    """
-    print("Running barcode extraction...")
-    result = subprocess.run(["python3", "barcode_extraction.py", image_path],
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            text=True)
-    if result.returncode != 0:
-        print("Error during barcode extraction:")
-        print(result.stderr)
-        sys.exit(1)
-    else:
-        print(result.stdout)
+def _ambiguous_patterns(imb_results):
+    """The reads with one low-confidence bar switched to its alternative, least confident first."""
+    patterns = []
+    for result in imb_results:
+        pattern, alternatives = result["pattern"], result["alternatives"]
+        confidence = np.array(result["confidence"])
+        for i in np.argsort(confidence, kind="stable")[:MAX_AMBIGUOUS_BARS]:
+            if confidence[i] < AMBIGUOUS_CONFIDENCE and alternatives[i] != pattern[i]:
+                patterns.append(pattern[:i] + alternatives[i] + pattern[i + 1:])
+    return patterns
+
+def _read_ladder(barcode, imb_results, debug=None):
+    """Yields (rung, patterns) for every READ_LADDER rung, computed only when reached."""
+    for rung in READ_LADDER:
+        if rung == "ambiguous_bars":
+            yield rung, _ambiguous_patterns(imb_results)
+        elif rung == "tolerance":
+            yield rung, [classify_bars(np.array(r["bars"], dtype=np.float64), tolerance=None)
+                         for r in imb_results]
+        elif rung == "denoised":
+            yield rung, [r["pattern"] for r in extract_all_imb(barcode["roi_views"], view="denoised_binary",
+                                                               debug=debug)]
 
-def process_barcode_images():
+def process_barcodes(image, debug=None):
     """
-    For each image in the BARCODE_DIR, run interpreter's extraction.
-    Returns a list of dictionaries with filename and interpreter results.
+    Runs barcode extraction in-process on the (deskewed) envelope image, then the
+    interpreter's IMB extraction on every barcode ROI it returns. Nothing is written to
+    or re-read from disk; `image` is an array or the envelope's EnvelopeImage.
+    Returns a list of dictionaries with the barcode name, its bounding box in `image`,
+    its IMB-likeness score, the interpreter results and "IMB Data": the first of its
+    patterns that decodes with a valid CRC (imb_decoder), or None. A barcode whose read
+    does not decode walks READ_LADDER; "Rung" records what decoded it ("primary" for
+    the first read, None if nothing did) and "Confidence" the read's least confident
+    bar. Only candidates that pass the extraction's regularity check
+    (barcode_extraction.score_candidate) get here, so text false positives are never
+    interpreted or reported. `debug` is the envelope's DebugContext, if any.
     """
     results = []
-    if not os.path.exists(BARCODE_DIR):
-        print("No barcode directory found. Skipping interpreter processing.")
-        return results
-
-    barcode_files = sorted([f for f in os.listdir(BARCODE_DIR) if f.lower().endswith(('.png', '.jpg', '.jpeg'))])
-    if not barcode_files:
-        print("No barcode images found in the barcode directory.")
+    barcodes = extract_barcodes(image, debug=debug)
+    if not barcodes:
+        print("No barcodes found in the envelope image.")
         return results
 
-    for file in barcode_files:
-        file_path = os.path.join(BARCODE_DIR, file)
-        barcode_img = cv2.imread(file_path)
-        if barcode_img is None:
-            print(f"Warning: Unable to load barcode image {file}")
-            continue
-        imb_results = extract_all_imb(barcode_img)
+    all_reads = []
+    for barcode in barcodes:
+        barcode_debug = debug.child(f"barcode_{barcode['index']}") if debug is not None else None
+        imb_results = extract_all_imb(barcode["roi_views"], debug=barcode_debug)
+        all_reads.append(imb_results)
         # For reporting, we can simply join any detected IMB patterns
         patterns = [group.get("pattern", "") for group in imb_results] if imb_results else []
+        confidence = [c for group in imb_results for c in group["confidence"]]
         results.append({
-            "Barcode File": file,
+            "Barcode": f"barcode_{barcode['index']}",
+            "BBox": [int(v) for v in barcode["bbox"]],
+            "Score": round(barcode["score"], 3),
+            "Confidence": min(confidence) if confidence else 0.0,
             "IMB Patterns": ", ".join(patterns) if patterns else "None"
         })
+
+    # Every pattern of every barcode is decoded in one batch
+    decoded = iter(decode_batch([r["pattern"] for reads in all_reads for r in reads]))
+    for entry, barcode, imb_results in zip(results, barcodes, all_reads):
+        valid = [d for d in (next(decoded) for _ in imb_results) if d is not None]
+        entry["IMB Data"] = valid[0] if valid else None
+        entry["Rung"] = "primary" if valid else None
+        if valid or not imb_results:
+            continue
+        ladder_debug = debug.child(f"barcode_{barcode['index']}_ladder") if debug is not None else None
+        for rung, patterns in _read_ladder(barcode, imb_results, ladder_debug):
+            valid = [d for d in decode_batch(patterns) if d is not None]
+            if valid:
+                entry["IMB Data"], entry["Rung"] = valid[0], rung
+                break
     return results
 
+def _retry_images(barcode_report, fallbacks, debug=None):
+    """
+    Reads the envelope's other images, (rung, image) in order, until one has a barcode
+    that decodes. Returns (report, rung, envelope): that image's report with its rungs
+    prefixed with the image's rung, the image's rung and its EnvelopeImage; or
+    (`barcode_report`, None, None) if none decodes.
+    """
+    for n, (rung, image) in enumerate(fallbacks):
+        envelope = preprocess(image)
+        report = process_barcodes(envelope, debug.child(f"{n}_{rung}") if debug is not None else None)
+        if any(entry["IMB Data"] is not None for entry in report):
+            for entry in report:
+                if entry["Rung"] is not None:
+                    entry["Rung"] = rung if entry["Rung"] == "primary" else f"{rung}/{entry['Rung']}"
+            return report, rung, envelope
+    return barcode_report, None, None
+
+def _imb_summary(entry):
+    data = entry.get("IMB Data")
+    if data is None:
+        return "Invalid (not decoded)"
+    return f"{data['tracking']} / {data['routing'] or '-'}"
+
+def ocr_address(image, debug=None):
+    """
+    OCRs the likely address blocks of the envelope, found by address_layout and anchored
+    on the IMB band. Falls back to OCR of the whole image when no block is found.
+    With a `debug` DebugContext the address crops are saved into it.
+    """
+    env = EnvelopeImage.wrap(image)
+    if not ADDRESS_ROI_OCR:
+        return perform_ocr(env.view("gray"))
+    # The interpreter runs in the other branch, so the anchor comes from the cheap
+    # thumbnail band locator rather than waiting on the barcode results
+    imb_bbox = locate_barcode_band(env)
+    crops = address_crops(env, imb_bbox)
+    if not crops:
+        return perform_ocr(env.view("gray"))
+    if debug is not None:
+        for i, (_, crop) in enumerate(crops):
+            debug.save(f"address_{i}.jpg", crop)
+    return "\n".join(perform_ocr(crop) for _, crop in crops)
+
+def _ocr_branch(image, debug=None):
+    return extract_pii(ocr_address(image, debug))
+
+def _join_branch(future, name, timeout, default):
+    """
+    Waits for a branch for at most `timeout` seconds from when it started running, and
+    for at most another `timeout` for it to start (behind other envelopes' branches).
+    A branch that times out or fails is reported and replaced by `default` so the
+    envelope is still reported with whatever the other branch found.
+    (A timed-out branch cannot be killed; its worker thread finishes in the background.)
+    """
+    if future is None:
+        return default
+    if not future.started.wait(timeout):
+        if future.cancel():
+            print(f"{name} branch did not start within {timeout:.1f} sec")
+            return default
+        future.started.wait()
+    remaining = max(0.0, future.started.at + timeout - time.monotonic())
+    try:
+        return future.result(timeout=remaining)
+    except concurrent.futures.TimeoutError:
+        print(f"{name} branch timed out after {timeout:.1f} sec")
+    except Exception as e:
+        print(f"{name} branch failed: {e}")
+    return default
+
 def envelopeProcessTrigger(image_path):
+    """
+    Processes an envelope image file (CLI entry point, and replay of images written to
+    ./cache2 or by the pipeline's audit side-channel).
+    """
+    name = os.path.splitext(os.path.basename(image_path))[0]
+    return process_envelope_image(cv2.imread(image_path, cv2.IMREAD_GRAYSCALE), name=name)
 
-    ### BARCODE EXTRACTION ###
-    deskew_original, equalized, thresh_adaptive = load_and_preprocess(image_path)
+def process_envelopes(item, ocr=True):
+    """
+    Pipeline envelope stage: processes the envelope once, from the best frame of the
+    first camera, and adds "report", the envelope's report payload (at most one upload
+    per envelope). The envelope's other images (see IMAGE_LADDER) are only read when
+    none of that frame's barcodes decodes; when the IMB is found on another camera's
+    frame, the address is OCRed from that frame too, since it saw the envelope's front.
+    """
+    images = item.pop("images")
+    alternates = item.pop("alternates", {})
+    cameras = sorted(images)
+    primary = cameras[0]
+    fallbacks = []
+    for rung in IMAGE_LADDER:
+        if rung == "next_frame":
+            fallbacks += [(rung, frame) for frame in alternates.get(primary, [])]
+        elif rung == "other_camera":
+            fallbacks += [(rung, images[cam]) for cam in cameras[1:]]
+    item["report"] = process_envelope_image(images[primary], ocr=ocr, fallbacks=fallbacks,
+                                            name=item.get("uuid"))
+    return item
 
-    # Step 1: Run barcode extraction on the envelope image
-    export_skew_path = save_debug_image("deskew_export.jpg", deskew_original, True)
-    print(export_skew_path)
-    run_barcode_extraction(export_skew_path)
-    # Step 2: Process each barcode image with interpreter extraction
-    barcode_report = process_barcode_images()
+def process_envelopes_barcode_only(item):
+    """Degraded envelope stage used under overload: IMB only, OCR is skipped."""
+    return process_envelopes(item, ocr=False)
+
+def process_envelope_image(original, ocr=True, fallbacks=(), name=None):
+    """
+    Runs barcode extraction, IMB interpretation and (unless `ocr` is False) OCR on an
+    in-memory grayscale envelope image, prints the report, spools it for upload and
+    returns the payload. `fallbacks` are other (rung, image) views of the same envelope
+    whose barcodes are read, in order, only if none of this image's decodes. The
+    address is read from this image, or from the "other_camera" fallback the IMB was
+    decoded from (the side of the envelope this image shows has neither). With DEBUG, the intermediate images go into
+    a scratch directory of this call's own, named after `name` (e.g. the envelope uuid).
+    """
+    if original is None:
+        print("Error: No envelope image to process")
+        return None
+
+    debug = DebugContext(name) if DEBUG else None
+    envelope = preprocess(original)
+    if debug is not None:
+        debug.save("deskewed.jpg", envelope.image)
+
+    # The barcode branch and the OCR branch only share the (read-only) deskewed image and
+    # its cached views, so they run concurrently and are joined here before the report/POST step.
+    ### BARCODE EXTRACTION ###
+    # Step 1: Run barcode extraction on the envelope image and
+    # Step 2: Process each barcode ROI with interpreter extraction
+    barcode_future = _branch_executor.submit(process_barcodes, envelope, debug)
 
     ### OCR AND EXTEMPORARY DATA EXTRACTION ###
-    # Step 3: Load envelope image for OCR and PII extraction
-    ocr_text = perform_ocr(deskew_original.copy())
-    pii_results = extract_pii(ocr_text)
+    # Step 3: OCR the address block(s) of the envelope and extract PII
+    ocr_future = _branch_executor.submit(_ocr_branch, envelope, debug) if ocr else None
+
+    barcode_report = _join_branch(barcode_future, "barcode", BARCODE_BRANCH_TIMEOUT, [])
+    pii_results = _join_branch(ocr_future, "OCR", OCR_BRANCH_TIMEOUT, {})
+    if fallbacks and not any(entry["IMB Data"] is not None for entry in barcode_report):
+        barcode_report, rung, fallback = _retry_images(barcode_report, fallbacks, debug)
+        if rung == "other_camera" and ocr:
+            ocr_debug = debug.child("other_camera_ocr") if debug is not None else None
+            pii_results = _join_branch(_branch_executor.submit(_ocr_branch, fallback, ocr_debug),
+                                       "OCR", OCR_BRANCH_TIMEOUT, {})
     
     ### REPORT AND EXPORT ###
     # Build the report as two sections:
     # Section 1: Barcode / IMB Analysis
-    barcode_headers = ["Barcode File", "IMB Patterns"]
-    barcode_table = [ [entry["Barcode File"], entry["IMB Patterns"]] for entry in barcode_report ]
+    barcode_headers = ["Barcode", "IMB Patterns", "Tracking / Routing", "Rung"]
+    barcode_table = [ [entry["Barcode"], entry["IMB Patterns"], _imb_summary(entry), entry["Rung"] or "-"]
+                      for entry in barcode_report ]
     # Section 2: OCR / PII Extraction
     ocr_headers = ["PII/Address Data"]
     # For display purposes, truncate OCR text if needed
@@ -296,24 +410,19 @@ def envelopeProcessTrigger(image_path):
     print("\nEnvelope OCR and PII Extraction:")
     print(tabulate(ocr_table, headers=ocr_headers, tablefmt="github"))
 
+    # Reads that fail the IMB check are reported above but never uploaded
+    valid_barcodes = [entry for entry in barcode_report if entry["IMB Data"] is not None]
     payload = {
-        'IMB': barcode_report, 
+        'IMB': valid_barcodes, 
         'OCR': pii_results, 
         'LOCATION': "Test Device", 
         'TIME': time.strftime("%H:%M:%S", time.localtime()), 
         'DATE': datetime.date.today().isoformat()
     }
-    if barcode_report:
-        try:
-            print("Attempting to post!")
-            response = requests.post('http://192.168.50.6:9100/envelopeData', json = payload, timeout = 10)
-            print("posted!")
-            print(response)
-        except requests.exceptions.Timeout:
-            print("TIMEOUT")
-            return
-        except requests.exceptions.RequestException as e:
-            print(f"Error: {e}")
+    if valid_barcodes:
+        # Spooled for the background uploader; processing never waits on the network
+        uploader.enqueue(payload)
+    return payload
         
 if __name__ == '__main__':  
     if len(sys.argv) != 2:
@@ -321,3 +430,5 @@ if __name__ == '__main__':
         sys.exit(1)
     image_path = sys.argv[1]
     envelopeProcessTrigger(image_path)
+    # No daemon running the uploader here, so try to send the spool once
+    uploader.Uploader().flush()
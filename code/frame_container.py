@@ -0,0 +1,117 @@
+import struct
+import numpy as np
+
+# On-disk frame container used to hand captures from takePictures to processPictures.
+#
+#   [header, HEADER_SIZE bytes][record 0][record 1]...
+#
+# Every record has the same size: a small fixed prefix (camera index, sequence number,
+# timestamp) followed by the raw frame bytes, so the whole body can be opened with a
+# single np.memmap using RECORD dtype and frames can be scored in place.
+# `count` in the header is only bumped after a record is fully written, so a reader can
+# open the file while the writer is still appending and will only see complete frames.
+
+MAGIC = b"EBFC"
+VERSION = 1
+HEADER_SIZE = 128
+
+# magic, version, ndim, dtype char, shape (4 dims), uuid (36 ascii), count
+_HEADER_STRUCT = struct.Struct("<4sHHc3x4I36sQ")
+_COUNT_OFFSET = _HEADER_STRUCT.size - 8
+_RECORD_PREFIX = struct.Struct("<B7xqd")
+
+
+def record_dtype(frame_shape, dtype=np.uint8):
+    """numpy dtype of one container record for frames of the given shape/dtype."""
+    return np.dtype([
+        ("camera", np.uint8),
+        ("seq", np.int64),
+        ("timestamp", np.float64),
+        ("frame", np.dtype(dtype), tuple(frame_shape)),
+    ], align=True)
+
+
+class FrameContainerWriter:
+    """
+    Appends frames to a container file. Frames must all share one shape and dtype.
+    """
+
+    def __init__(self, path, frame_shape, dtype=np.uint8, uuid=""):
+        if len(frame_shape) > 4:
+            raise ValueError("Frames may have at most 4 dimensions")
+        self.path = path
+        self.frame_shape = tuple(frame_shape)
+        self.dtype = np.dtype(dtype)
+        self.count = 0
+
+        rec = record_dtype(self.frame_shape, self.dtype)
+        frame_bytes = int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        self._pad = b"\0" * (rec.itemsize - _RECORD_PREFIX.size - frame_bytes)
+
+        shape = list(self.frame_shape) + [0] * (4 - len(self.frame_shape))
+        header = _HEADER_STRUCT.pack(MAGIC, VERSION, len(self.frame_shape),
+                                     self.dtype.char.encode("ascii"), *shape,
+                                     uuid.encode("ascii"), 0)
+        self._file = open(path, "wb")
+        self._file.write(header.ljust(HEADER_SIZE, b"\0"))
+
+    def append(self, camera, frame, seq=-1, timestamp=0.0):
+        """Writes one frame (e.g. a zero-copy view from a FrameRing) as a new record."""
+        if frame.shape != self.frame_shape:
+            raise ValueError(f"Frame shape {frame.shape} does not match container {self.frame_shape}")
+        self._file.write(_RECORD_PREFIX.pack(camera, seq, timestamp))
+        self._file.write(memoryview(np.ascontiguousarray(frame, dtype=self.dtype)).cast("B"))
+        self._file.write(self._pad)
+
+        # Publish the record only once its bytes are in the file
+        self.count += 1
+        self._file.seek(_COUNT_OFFSET)
+        self._file.write(struct.pack("<Q", self.count))
+        self._file.seek(0, 2)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_header(path):
+    """Returns the container header as a dict."""
+    with open(path, "rb") as f:
+        raw = f.read(_HEADER_STRUCT.size)
+    magic, version, ndim, dtype_char, *rest = _HEADER_STRUCT.unpack(raw)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a frame container")
+    shape, uuid, count = rest[:4], rest[4], rest[5]
+    return {
+        "version": version,
+        "frame_shape": tuple(shape[:ndim]),
+        "dtype": np.dtype(dtype_char.decode("ascii")),
+        "uuid": uuid.rstrip(b"\0").decode("ascii"),
+        "count": count,
+    }
+
+
+def open_frames(path):
+    """
+    Memory-maps a container read-only.
+    Returns (header dict, records) where `records` is a structured np.memmap with the
+    fields camera, seq, timestamp and frame. Nothing is deserialized or copied.
+    """
+    header = read_header(path)
+    rec = record_dtype(header["frame_shape"], header["dtype"])
+    if header["count"] == 0:
+        return header, np.zeros((0,), dtype=rec)
+    records = np.memmap(path, dtype=rec, mode="r", offset=HEADER_SIZE, shape=(header["count"],))
+    return header, records
+
+
+def camera_frames(records, camera):
+    """List of zero-copy frame views belonging to camera index `camera`."""
+    frames = records["frame"]
+    return [frames[i] for i in np.flatnonzero(records["camera"] == camera)]
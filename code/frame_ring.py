@@ -0,0 +1,174 @@
+import sys
+import time
+import numpy as np
+from multiprocessing import resource_tracker, shared_memory
+
+# Header layout (int64 words) at the start of every ring's shared-memory block.
+_MAGIC = 0x45424652  # "EBFR"
+_H_MAGIC = 0
+_H_SLOTS = 1
+_H_DTYPE = 2
+_H_NDIM = 3
+_H_SHAPE = 4          # up to 4 dims: words 4..7
+_H_WRITE_SEQ = 8      # sequence number the next frame will get
+_HEADER_WORDS = 16
+_MAX_DIMS = 4
+
+
+class FrameRing:
+    """
+    Preallocated, fixed-size ring of frames stored in a named shared-memory block.
+
+    The single writer (the camera's capture thread) copies each frame straight into the
+    next slot and stamps it with a monotonically increasing sequence number and a
+    `time.monotonic()` timestamp. Readers (triggers, or other processes that `attach`
+    by name) get zero-copy views of the slots. Only the creating process unlinks the
+    block, when it closes the ring; readers that attached only close their mapping.
+
+    Layout: [header int64 x 16][seq int64 x slots][timestamp float64 x slots][frames]
+
+    NOTE: Views are only valid until the writer wraps around onto that slot
+    (slots / frame rate seconds). Use `is_valid(seq)` after consuming a view if that
+    matters, or copy it.
+    """
+
+    def __init__(self, shm, owner):
+        self._shm = shm
+        self._owner = owner
+        buf = shm.buf
+
+        self._header = np.ndarray((_HEADER_WORDS,), dtype=np.int64, buffer=buf)
+        if self._header[_H_MAGIC] != _MAGIC:
+            raise ValueError(f"Shared memory block '{shm.name}' is not a frame ring")
+
+        self.slots = int(self._header[_H_SLOTS])
+        self.dtype = np.dtype(chr(self._header[_H_DTYPE]))
+        ndim = int(self._header[_H_NDIM])
+        self.frame_shape = tuple(int(d) for d in self._header[_H_SHAPE:_H_SHAPE + ndim])
+
+        offset = _HEADER_WORDS * 8
+        self._seq = np.ndarray((self.slots,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += self.slots * 8
+        self._timestamps = np.ndarray((self.slots,), dtype=np.float64, buffer=buf, offset=offset)
+        offset += self.slots * 8
+        self._frames = np.ndarray((self.slots,) + self.frame_shape, dtype=self.dtype,
+                                  buffer=buf, offset=offset)
+
+    @staticmethod
+    def _size_for(shape, dtype, slots):
+        frame_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        return _HEADER_WORDS * 8 + slots * 16 + slots * frame_bytes
+
+    @classmethod
+    def create(cls, name, frame_shape, dtype=np.uint8, slots=64):
+        """
+        Allocates a new ring. A stale block left behind under the same name (e.g. by a
+        crashed previous run) is unlinked and replaced.
+        """
+        if len(frame_shape) > _MAX_DIMS:
+            raise ValueError(f"Frames may have at most {_MAX_DIMS} dimensions")
+        size = cls._size_for(frame_shape, dtype, slots)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        header = np.ndarray((_HEADER_WORDS,), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[_H_MAGIC] = _MAGIC
+        header[_H_SLOTS] = slots
+        header[_H_DTYPE] = ord(np.dtype(dtype).char)
+        header[_H_NDIM] = len(frame_shape)
+        header[_H_SHAPE:_H_SHAPE + len(frame_shape)] = frame_shape
+        del header
+
+        ring = cls(shm, owner=True)
+        ring._seq[:] = -1
+        ring._timestamps[:] = 0.0
+        return ring
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Attaches to a ring created by another process (threads of the creating process
+        share its FrameRing instead). The block is not tracked in this process, so it
+        outlives the reader: before Python 3.13 the resource tracker of the attaching
+        process unlinks every block it tracks when that process exits, and would delete
+        the live ring out from under the camera.
+        """
+        if sys.version_info >= (3, 13):
+            return cls(shared_memory.SharedMemory(name=name, track=False), owner=False)
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, owner=False)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def latest_seq(self):
+        """Sequence number of the newest complete frame, or -1 if none yet."""
+        return int(self._header[_H_WRITE_SEQ]) - 1
+
+    def write(self, frame, timestamp=None):
+        """
+        Copies `frame` into the next slot. Must only be called from one writer.
+        Returns the sequence number assigned to the frame.
+        """
+        seq = int(self._header[_H_WRITE_SEQ])
+        idx = seq % self.slots
+        # Mark the slot as in-flight so readers skip it while it is being overwritten
+        self._seq[idx] = -1
+        np.copyto(self._frames[idx], frame)
+        self._timestamps[idx] = time.monotonic() if timestamp is None else timestamp
+        self._seq[idx] = seq
+        self._header[_H_WRITE_SEQ] = seq + 1
+        return seq
+
+    def is_valid(self, seq):
+        """True while the frame with sequence number `seq` has not been overwritten."""
+        return seq >= 0 and self._seq[seq % self.slots] == seq
+
+    def get(self, seq):
+        """Returns (timestamp, view) for `seq`, or None if it is not in the ring."""
+        idx = seq % self.slots
+        if seq < 0 or self._seq[idx] != seq:
+            return None
+        return float(self._timestamps[idx]), self._frames[idx]
+
+    def frames_between(self, start, end):
+        """
+        Returns a list of (seq, timestamp, view) tuples, oldest first, for every frame
+        whose timestamp falls in [start, end). No pixel data is copied.
+        """
+        seqs = self._seq.copy()
+        stamps = self._timestamps.copy()
+        mask = (seqs >= 0) & (stamps >= start) & (stamps < end)
+        idxs = np.flatnonzero(mask)
+        idxs = idxs[np.argsort(seqs[idxs])]
+        return [(int(seqs[i]), float(stamps[i]), self._frames[i]) for i in idxs]
+
+    def frames_since(self, seq):
+        """Returns (seq, timestamp, view) tuples for every frame newer than `seq`."""
+        results = []
+        for s in range(max(seq + 1, self.latest_seq - self.slots + 1), self.latest_seq + 1):
+            entry = self.get(s)
+            if entry is not None:
+                results.append((s, entry[0], entry[1]))
+        return results
+
+    def last(self, seconds):
+        """Zero-copy views of the frames captured in the last `seconds` seconds."""
+        now = time.monotonic()
+        return self.frames_between(now - seconds, now + 1.0)
+
+    def close(self):
+        # Drop our views before closing, otherwise the mmap cannot be released
+        self._header = self._seq = self._timestamps = self._frames = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
@@ -0,0 +1,166 @@
+import heapq
+import itertools
+import cv2
+import numpy as np
+from barcode_band import locate_barcode_band, BAND_SCALE
+
+# Batch scoring defaults: rank on quarter-scale thumbnails, then re-score only the few
+# best candidates at full resolution.
+SCORE_SCALE = 0.25
+REFINE_TOP = 3
+
+# Band scoring: localize the IMB on a thumbnail (barcode_band.BAND_SCALE), then measure
+# sharpness at full resolution inside the band grown by BAND_PADDING pixels per side.
+BAND_PADDING = 12
+
+
+def laplacian_sharpness(frame):
+    """
+    Edge intensity of a frame: mean absolute Laplacian of a lightly blurred copy.
+    Higher is sharper. This is the score processPictures has always ranked frames by
+    (computed in int16 with a saturating cast rather than float64).
+    """
+    blurred = cv2.GaussianBlur(frame, (3, 3), 0)
+    laplacian = cv2.Laplacian(blurred, cv2.CV_16S)
+    return float(cv2.mean(cv2.convertScaleAbs(laplacian))[0])
+
+
+def _crop(frame, roi):
+    if roi is None:
+        return frame
+    x, y, w, h = roi
+    return frame[y:y + h, x:x + w]
+
+
+def batch_sharpness(frames, scale=SCORE_SCALE, roi=None):
+    """
+    Scores a whole batch of frames at once.
+
+    Parameters:
+        frames: (N, H, W) array (e.g. a frame container memmap) or list of 2D frames.
+        scale (float): Thumbnail scale; INTER_AREA downsampling doubles as the blur.
+        roi (tuple): Optional (x, y, w, h) in full-resolution pixels to score within.
+
+    Returns:
+        np.array of N scores (mean absolute Laplacian of each thumbnail).
+    """
+    first = _crop(frames[0], roi)
+    th = max(3, int(round(first.shape[0] * scale)))
+    tw = max(3, int(round(first.shape[1] * scale)))
+    stack = np.empty((len(frames), th, tw), dtype=np.float32)
+    for i in range(len(frames)):
+        stack[i] = cv2.resize(_crop(frames[i], roi), (tw, th), interpolation=cv2.INTER_AREA)
+
+    # 4-neighbour Laplacian over the whole stack in one pass
+    center = stack[:, 1:-1, 1:-1]
+    laplacian = (4.0 * center - stack[:, :-2, 1:-1] - stack[:, 2:, 1:-1]
+                 - stack[:, 1:-1, :-2] - stack[:, 1:-1, 2:])
+    return np.abs(laplacian).mean(axis=(1, 2))
+
+
+def ranked_frame_indices(frames, scale=SCORE_SCALE, roi=None, refine_top=REFINE_TOP):
+    """
+    Indices of the `refine_top` sharpest frames, best first. Frames are ranked coarsely
+    on thumbnails; the `refine_top` best are then re-scored at full resolution (within
+    `roi`).
+    """
+    if len(frames) == 0:
+        raise ValueError("No frames to score")
+    coarse = batch_sharpness(frames, scale, roi)
+    if refine_top <= 1 or len(frames) == 1:
+        return [int(np.argmax(coarse))]
+
+    k = min(refine_top, len(frames))
+    top = np.argpartition(-coarse, k - 1)[:k]
+    fine = [laplacian_sharpness(_crop(frames[i], roi)) for i in top]
+    return [int(top[i]) for i in np.argsort(fine)[::-1]]
+
+
+def best_frame_index(frames, scale=SCORE_SCALE, roi=None, refine_top=REFINE_TOP):
+    """Index of the sharpest frame (see ranked_frame_indices)."""
+    return ranked_frame_indices(frames, scale, roi, refine_top)[0]
+
+
+def band_sharpness(frame, scale=BAND_SCALE, padding=BAND_PADDING):
+    """
+    Sharpness measured only inside the frame's likely barcode band, so the winning frame
+    is the one whose IMB bars are crisp rather than the one with the most edges overall.
+    Returns None when no barcode band is found in the frame.
+    """
+    band = locate_barcode_band(frame, scale)
+    if band is None:
+        return None
+    x, y, w, h = band
+    x1, y1 = max(0, x - padding), max(0, y - padding)
+    return laplacian_sharpness(frame[y1:y + h + padding, x1:x + w + padding])
+
+
+def frame_score(frame, mode="band", roi=None):
+    """
+    Score of a single frame under a processPictures.SCORING_MODE, for online selection
+    (TopKFrameSelector). In "band" mode a frame showing a barcode band scores
+    (1, band sharpness) and any other frame (0, global sharpness), so every band frame
+    outranks every frame without one, as in band_frame_ranking with its global fallback.
+    In "global" mode every frame scores (0, sharpness within `roi`).
+    """
+    if mode == "band":
+        score = band_sharpness(frame)
+        if score is not None:
+            return (1, score)
+    return (0, laplacian_sharpness(_crop(frame, roi)))
+
+
+def band_frame_ranking(frames, scale=BAND_SCALE):
+    """
+    Indices of the frames that show a barcode band, sharpest band first (empty if no
+    frame has one).
+    """
+    scores = [(band_sharpness(frames[i], scale), i) for i in range(len(frames))]
+    return [i for score, i in sorted((s for s in scores if s[0] is not None), key=lambda s: -s[0])]
+
+
+def band_frame_index(frames, scale=BAND_SCALE):
+    """
+    Index of the frame with the sharpest barcode band, or None if no frame has one
+    (callers then fall back to global scoring with best_frame_index).
+    """
+    ranking = band_frame_ranking(frames, scale)
+    return ranking[0] if ranking else None
+
+
+class TopKFrameSelector:
+    """
+    Online best-frame selection for one camera.
+
+    Each frame is scored as it arrives and only the K best are kept (copied out of the
+    capture ring) in a min-heap, so memory is O(K) regardless of how long the capture
+    window is, and the best frame is known as soon as the window closes.
+    """
+
+    def __init__(self, k=3, scorer=laplacian_sharpness):
+        self.k = k
+        self.scorer = scorer
+        self.frames_seen = 0
+        self._heap = []  # (score, tie-breaker, seq, timestamp, frame)
+        self._counter = itertools.count()
+
+    def offer(self, frame, seq=-1, timestamp=0.0):
+        """Scores `frame` and keeps a copy of it if it is among the K best so far."""
+        score = self.scorer(frame)
+        self.frames_seen += 1
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, (score, next(self._counter), seq, timestamp, frame.copy()))
+        elif score > self._heap[0][0]:
+            heapq.heapreplace(self._heap, (score, next(self._counter), seq, timestamp, frame.copy()))
+        return score
+
+    def ranked(self):
+        """Kept frames, best first, as (score, seq, timestamp, frame) tuples."""
+        return [(score, seq, timestamp, frame)
+                for score, _, seq, timestamp, frame in sorted(self._heap, reverse=True)]
+
+    def best(self):
+        """The sharpest frame seen so far, or None if no frame was offered."""
+        if not self._heap:
+            return None
+        return max(self._heap)[4]
@@ -0,0 +1,319 @@
+import sys
+import numpy as np
+
+# Intelligent Mail Barcode decoder (USPS-B-3200): 65-bar FADT pattern -> characters ->
+# codewords -> 102-bit binary value -> tracking code (barcode ID, service type, mailer
+# ID, serial) and routing code, with the 11-bit frame check sequence (CRC) verified.
+#
+# Everything per bar and per character is table lookups over NumPy arrays, so
+# decode_batch() handles a whole array of patterns at once; only the final big-integer
+# arithmetic and the (table-driven) CRC run per pattern.
+
+BARS = 65
+CHARACTERS = 10
+BAR_STATES = "FADT"
+
+# Bar-to-character mapping (USPS-B-3200 Table 22): for each bar, the character and bit
+# that drive its descender, then the character and bit that drive its ascender.
+BAR_TABLE = (
+    (7, 2, 4, 3), (1, 10, 0, 0), (9, 12, 2, 8), (5, 5, 6, 11), (8, 9, 3, 1),
+    (0, 1, 5, 12), (2, 5, 1, 8), (4, 4, 9, 11), (6, 3, 8, 10), (3, 9, 7, 6),
+    (5, 11, 1, 4), (8, 5, 2, 12), (9, 10, 0, 2), (7, 1, 6, 7), (3, 6, 4, 9),
+    (0, 3, 8, 6), (6, 4, 2, 7), (1, 1, 9, 9), (7, 10, 5, 2), (4, 0, 3, 8),
+    (6, 2, 0, 4), (8, 11, 1, 0), (9, 8, 3, 12), (2, 6, 7, 7), (5, 1, 4, 10),
+    (1, 12, 6, 9), (7, 3, 8, 0), (5, 8, 9, 7), (4, 6, 2, 10), (3, 4, 0, 5),
+    (8, 4, 5, 7), (7, 11, 1, 9), (6, 0, 9, 6), (0, 6, 4, 8), (2, 1, 3, 2),
+    (5, 9, 8, 12), (4, 11, 6, 1), (9, 5, 7, 4), (3, 3, 1, 2), (0, 7, 2, 0),
+    (1, 3, 4, 1), (6, 10, 3, 5), (8, 7, 9, 4), (2, 11, 5, 6), (0, 8, 7, 12),
+    (4, 2, 8, 1), (5, 10, 3, 0), (9, 3, 0, 9), (6, 5, 2, 4), (7, 8, 1, 7),
+    (5, 0, 4, 5), (2, 3, 0, 10), (6, 12, 9, 2), (3, 11, 1, 6), (8, 8, 7, 9),
+    (5, 4, 0, 11), (1, 5, 2, 2), (9, 1, 4, 12), (8, 3, 6, 6), (7, 0, 3, 7),
+    (4, 7, 7, 5), (0, 12, 1, 11), (2, 9, 9, 0), (6, 8, 5, 3), (3, 10, 8, 2),
+)
+
+CRC_POLYNOMIAL = 0x0F35
+CRC_INIT = 0x7FF
+
+# Codeword A carries the CRC's most significant bit by an offset of 659
+CODEWORD_A_OFFSET = 659
+# Routing code ranges in the binary value (0 means no routing code)
+ROUTING_OFFSETS = ((11, 1000100001), (9, 100001), (5, 1))
+
+
+class ImbDecodeError(ValueError):
+    """Raised by decode() for a pattern that is not a valid IMB."""
+
+
+def _reverse13(value):
+    return int(f"{value:013b}"[::-1], 2)
+
+
+def _n_of_13_table(n, size):
+    """
+    Codeword -> character table for the 13-bit characters with `n` bits set, built as in
+    USPS-B-3200: characters are taken in increasing order, each followed by its bit
+    reversal, and the palindromes are filled in from the end of the table.
+    """
+    table = [0] * size
+    low, high = 0, size - 1
+    for c in range(8192):
+        if bin(c).count("1") != n:
+            continue
+        r = _reverse13(c)
+        if r < c:
+            continue
+        if r == c:
+            table[high] = c
+            high -= 1
+        else:
+            table[low] = c
+            table[low + 1] = r
+            low += 2
+    return table
+
+
+# Codeword -> character (0-1286: 5 of 13, 1287-1364: 2 of 13) and its reverse lookup
+# (-1 for characters that are not valid codewords)
+_CODEWORD_TO_CHAR = _n_of_13_table(5, 1287) + _n_of_13_table(2, 78)
+_CHAR_TO_CODEWORD = np.full(8192, -1, dtype=np.int32)
+_CHAR_TO_CODEWORD[_CODEWORD_TO_CHAR] = np.arange(len(_CODEWORD_TO_CHAR))
+
+# Bit count of every 13-bit character: 5 or 2 set bits as is, 8 or 11 when inverted
+_POPCOUNT = np.array([bin(c).count("1") for c in range(8192)], dtype=np.uint8)
+
+# Bar state -> (descender bit, ascender bit)
+_STATE_LOOKUP = np.full(256, 255, dtype=np.uint8)
+for _state, _bits in zip("TDAF", range(4)):
+    _STATE_LOOKUP[ord(_state)] = _bits
+_BAR_TABLE = np.array(BAR_TABLE, dtype=np.int64)
+
+
+def _crc_table(bits):
+    """CRC-11 table for feeding `bits` bits at a time, most significant bit first."""
+    table = []
+    for value in range(1 << bits):
+        crc = value << (11 - bits)
+        for _ in range(bits):
+            crc = ((crc << 1) ^ CRC_POLYNOMIAL) if crc & 0x400 else (crc << 1)
+            crc &= 0x7FF
+        table.append(crc)
+    return table
+
+
+_CRC_TABLE_8 = _crc_table(8)
+_CRC_TABLE_6 = _crc_table(6)
+
+
+def crc11(value):
+    """
+    The 11-bit frame check sequence of a 102-bit binary value: the value as 13 bytes,
+    most significant first, of which the first contributes only its low 6 bits.
+    """
+    data = value.to_bytes(13, "big")
+    crc = CRC_INIT
+    crc = ((crc << 6) ^ _CRC_TABLE_6[((crc >> 5) ^ data[0]) & 0x3F]) & 0x7FF
+    for byte in data[1:]:
+        crc = ((crc << 8) ^ _CRC_TABLE_8[((crc >> 3) ^ byte) & 0xFF]) & 0x7FF
+    return crc
+
+
+def _states(patterns):
+    """(N, 65) array of bar state codes (bit 0 descender, bit 1 ascender), or raises."""
+    raw = np.frombuffer("".join(patterns).encode("ascii"), dtype=np.uint8)
+    if len(raw) != BARS * len(patterns):
+        raise ImbDecodeError(f"IMB patterns must be {BARS} bars long")
+    states = _STATE_LOOKUP[raw].reshape(len(patterns), BARS)
+    if np.any(states == 255):
+        raise ImbDecodeError("IMB patterns may only contain F, A, D and T")
+    return states
+
+
+def _codewords(states):
+    """
+    Bars -> characters -> codewords for an (N, 65) state array.
+
+    Returns:
+        (codewords, fcs_bits, valid): (N, 10) codewords, the 10 low FCS bits read from the
+        character inversions as an (N,) int array, and an (N,) mask of patterns whose
+        characters are all valid.
+    """
+    count = len(states)
+    descender = (states & 1).astype(np.int64)
+    ascender = (states >> 1).astype(np.int64)
+    chars = np.zeros((count, CHARACTERS), dtype=np.int64)
+    rows = np.arange(count)[:, None]
+    np.add.at(chars, (rows, _BAR_TABLE[None, :, 0]), descender << _BAR_TABLE[None, :, 1])
+    np.add.at(chars, (rows, _BAR_TABLE[None, :, 2]), ascender << _BAR_TABLE[None, :, 3])
+
+    # Characters with 8 or 11 bits set were inverted to carry an FCS bit
+    popcount = _POPCOUNT[chars]
+    inverted = (popcount == 8) | (popcount == 11)
+    chars = np.where(inverted, ~chars & 0x1FFF, chars)
+    codewords = _CHAR_TO_CODEWORD[chars]
+    fcs_bits = (inverted.astype(np.int64) << np.arange(CHARACTERS)).sum(axis=1)
+    valid = np.all(codewords >= 0, axis=1) & (codewords[:, 9] % 2 == 0)
+    return codewords, fcs_bits, valid
+
+
+def _fields(value):
+    """Binary value -> decoded tracking and routing fields."""
+    digits = []
+    for _ in range(18):
+        value, digit = divmod(value, 10)
+        digits.append(str(digit))
+    value, id_second = divmod(value, 5)
+    value, id_first = divmod(value, 10)
+    tracking = f"{id_first}{id_second}" + "".join(reversed(digits))
+
+    routing = ""
+    for length, offset in ROUTING_OFFSETS:
+        if value >= offset:
+            routing = str(value - offset).zfill(length)
+            if len(routing) > length:
+                raise ImbDecodeError("Routing code out of range")
+            break
+    return split_tracking(tracking, routing)
+
+
+def split_tracking(tracking, routing=""):
+    """
+    The decoded-fields dict (see decode()) of a 20-digit tracking code and a routing
+    code. Mailer IDs starting with 9 are 9 digits (with a 6-digit serial), others are 6.
+    """
+    mailer_length = 9 if tracking[5] == "9" else 6
+    return {
+        "barcode_id": tracking[0:2],
+        "service_type": tracking[2:5],
+        "mailer_id": tracking[5:5 + mailer_length],
+        "serial": tracking[5 + mailer_length:20],
+        "routing": routing,
+        "tracking": tracking,
+    }
+
+
+def _decode_one(codewords, fcs_bits):
+    a = int(codewords[0])
+    if a >= CODEWORD_A_OFFSET:
+        a -= CODEWORD_A_OFFSET
+        fcs_bits |= 1 << 10
+    if a >= CODEWORD_A_OFFSET:
+        raise ImbDecodeError("Codeword A out of range")
+    value = a
+    for cw in codewords[1:9]:
+        value = value * 1365 + int(cw)
+    value = value * 636 + int(codewords[9]) // 2
+    if crc11(value) != fcs_bits:
+        raise ImbDecodeError("Frame check sequence mismatch")
+    return _fields(value)
+
+
+def encode(tracking, routing=""):
+    """
+    Encodes a 20-digit tracking code and a 0, 5, 9 or 11 digit routing code into its
+    FADT pattern (for checking the decoder and for test envelopes).
+    """
+    if len(tracking) != 20 or not tracking.isdigit() or tracking[1] not in "01234":
+        raise ValueError("Tracking code must be 20 digits with a second digit of 0-4")
+    if len(routing) not in (0, 5, 9, 11) or (routing and not routing.isdigit()):
+        raise ValueError("Routing code must be 0, 5, 9 or 11 digits")
+
+    value = 0
+    for length, offset in ROUTING_OFFSETS:
+        if len(routing) == length:
+            value = int(routing) + offset
+    value = (value * 10 + int(tracking[0])) * 5 + int(tracking[1])
+    for digit in tracking[2:]:
+        value = value * 10 + int(digit)
+    fcs = crc11(value)
+
+    value, j = divmod(value, 636)
+    codewords = [j * 2]
+    for _ in range(8):
+        value, cw = divmod(value, 1365)
+        codewords.append(cw)
+    codewords.append(value + (CODEWORD_A_OFFSET if fcs & (1 << 10) else 0))
+    codewords.reverse()
+
+    chars = [_CODEWORD_TO_CHAR[cw] for cw in codewords]
+    chars = [~c & 0x1FFF if fcs >> i & 1 else c for i, c in enumerate(chars)]
+    return "".join(
+        "TDAF"[(chars[dc] >> db & 1) | (chars[ac] >> ab & 1) << 1]
+        for dc, db, ac, ab in BAR_TABLE
+    )
+
+
+def flip(pattern):
+    """The pattern as read from a barcode upside down (bars reversed, A and D swapped)."""
+    return pattern[::-1].translate(str.maketrans("AD", "DA"))
+
+
+def decode(pattern, try_flipped=True):
+    """
+    Decodes one 65-bar FADT pattern.
+
+    Parameters:
+        pattern (str): Bar states, left to right.
+        try_flipped (bool): Also try the pattern as read upside down.
+
+    Returns:
+        A dict with 'barcode_id', 'service_type', 'mailer_id', 'serial', 'routing'
+        ('' when there is none) and 'tracking' (all 20 tracking digits).
+
+    Raises:
+        ImbDecodeError: the pattern is not a valid IMB (wrong length, an invalid
+            character, or a CRC mismatch).
+    """
+    candidates = [pattern, flip(pattern)] if try_flipped else [pattern]
+    error = None
+    for candidate in candidates:
+        try:
+            codewords, fcs_bits, valid = _codewords(_states([candidate]))
+            if not valid[0]:
+                raise ImbDecodeError("Invalid character in pattern")
+            return _decode_one(codewords[0], int(fcs_bits[0]))
+        except ImbDecodeError as e:
+            error = error or e
+    raise error
+
+
+def decode_batch(patterns, try_flipped=True):
+    """
+    Decodes many patterns at once. The bar -> character -> codeword steps run as array
+    operations over the whole batch.
+
+    Returns:
+        A list with, for every pattern, its decode() dict or None when it is not a valid
+        IMB (malformed patterns included).
+    """
+    patterns = list(patterns)
+    results = [None] * len(patterns)
+    well_formed = [i for i, p in enumerate(patterns)
+                   if len(p) == BARS and not p.strip(BAR_STATES)]
+    if not well_formed:
+        return results
+
+    attempts = [[patterns[i] for i in well_formed]]
+    if try_flipped:
+        attempts.append([flip(patterns[i]) for i in well_formed])
+    for attempt in attempts:
+        codewords, fcs_bits, valid = _codewords(_states(attempt))
+        for k in np.flatnonzero(valid):
+            i = well_formed[k]
+            if results[i] is not None:
+                continue
+            try:
+                results[i] = _decode_one(codewords[k], int(fcs_bits[k]))
+            except ImbDecodeError:
+                pass
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python imb_decoder.py <FADT pattern>")
+        sys.exit(1)
+    try:
+        print(decode(sys.argv[1].strip().upper()))
+    except ImbDecodeError as e:
+        print(f"Invalid IMB: {e}")
+        sys.exit(1)
@@ -1,209 +1,245 @@
-import os
+import functools
 import cv2
 import numpy as np
-import pytesseract
-import re
-import sys
+from envelope_image import EnvelopeImage
 
-OUTPUT_DIR = "./out"
-DEBUG_DIR = "./debug"
+# The interpreter keeps no state between calls: everything it needs comes in as
+# arguments, and debug images are only written into the DebugContext (a per-envelope
+# scratch directory) a caller passes in, so any number of threads or processes can
+# interpret envelopes at once.
 
-DEBUG = True
+# Component filtering, grouping and classification parameters
+MIN_VERTICAL_RATIO = 1.5  # h / w; rounder components are letters or noise
+Y_THRESHOLD = 40          # maximum difference in center_y (in pixels) for grouping
+MIN_GROUP_BARS = 30       # groups with fewer bars are not IMBs
+GROUP_PADDING = 25        # pixels around a group for the refinement pass
+TOLERANCE = 15            # pixels; how close a bar end must be to the group top/bottom
+TOLERANCE_FRACTION = 0.2  # of the group height, used instead when tolerance is None
 
-itter = 0
+# Candidate stats are kept as an (N, 5) array with these columns
+X, Y, W, H, CY = range(5)
 
-def save_debug_image(filename, image):
-    """Helper to save images into the debug folder."""
-    global itter
-    global DEBUG
-    if (DEBUG):
-        cv2.imwrite(os.path.join(DEBUG_DIR, str(itter) + "_" + filename), image)
+def candidate_stats(binary):
+    """
+    Runs connected components on a binarized image and keeps the vertical, bar-like
+    ones. Returns an (N, 5) float array of x, y, w, h, center_y.
+    """
+    _, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    stats = stats[1:, :4].astype(np.float64)  # skip the background
+    keep = stats[:, 3] / stats[:, 2] >= MIN_VERTICAL_RATIO
+    stats = stats[keep]
+    return np.column_stack((stats, stats[:, Y] + stats[:, H] / 2))
 
-def save_output_image(filename, image):
-    """Helper to save images into the output folder."""
-    cv2.imwrite(os.path.join(OUTPUT_DIR, filename), image)
+def group_candidates(cands, y_threshold=Y_THRESHOLD, min_bars=MIN_GROUP_BARS):
+    """
+    Groups candidates by vertical proximity in one sweep: sorted by center_y, each
+    candidate joins the current group if it is within `y_threshold` of the group's
+    running mean center, and starts a new group otherwise.
 
-def extract_all_imb(image):
+    Returns a list of (n, 5) arrays (groups of at least `min_bars`), each sorted by x.
     """
-    Attempts to detect multiple Intelligent Mail Barcodes (IMBs) in the entire image
-    using open source methods.
-    
-    Steps:
-      1. Convert the entire image to grayscale and apply a binary inverse threshold.
-      2. Apply a modest morphological closing with a vertical kernel (1x3) to reconnect broken vertical segments.
-      3. Use connectedComponentsWithStats to identify candidate bar regions.
-      4. Filter out small or irrelevant components (including those with low vertical-to-horizontal ratios).
-         (Thresholds have been lowered to allow small 'T' bars.)
-      5. Group candidate bars into clusters based on their vertical proximity.
-      6. For each group (candidate IMB), sort the bars by x-coordinate and classify each using four modalities:
-           - F (Full): The candidate touches (within tolerance) both the group top and bottom.
-           - A (Ascender): The candidate touches the group top (within tolerance) and extends downward past the middle.
-           - D (Descender): The candidate touches the group bottom (within tolerance) and extends upward past the middle.
-           - T (Tiny): If the candidate’s height is less than about 30% of the group height.
-      7. Annotate each candidate bar on a debug image with its classification.
-    
+    if len(cands) == 0:
+        return []
+    cands = cands[np.argsort(cands[:, CY], kind="stable")]
+    groups = []
+    start, total = 0, cands[0, CY]
+    for i in range(1, len(cands)):
+        cy = cands[i, CY]
+        if abs(cy - total / (i - start)) < y_threshold:
+            total += cy
+        else:
+            groups.append(cands[start:i])
+            start, total = i, cy
+    groups.append(cands[start:])
+    return [g[np.argsort(g[:, X], kind="stable")] for g in groups if len(g) >= min_bars]
+
+def group_bbox(group):
+    """Bounding box (x, y, w, h) of a group of candidates."""
+    x0, y0 = group[:, X].min(), group[:, Y].min()
+    x1, y1 = (group[:, X] + group[:, W]).max(), (group[:, Y] + group[:, H]).max()
+    return (int(x0), int(y0), int(x1 - x0), int(y1 - y0))
+
+def _bar_geometry(group, tolerance):
+    """Bar ends, group extent and the tolerance in pixels (None: TOLERANCE_FRACTION)."""
+    top = group[:, Y]
+    bottom = group[:, Y] + group[:, H]
+    group_y_min, group_y_max = top.min(), bottom.max()
+    group_height = group_y_max - group_y_min
+    if tolerance is None:
+        tolerance = TOLERANCE_FRACTION * group_height
+    return top, bottom, group_y_min, group_y_max, group_height, max(tolerance, 1.0)
+
+def _labels(group, group_height, mid, top, bottom, touches_top, touches_bottom):
+    labels = np.select(
+        [group[:, H] < 0.3 * group_height,
+         touches_top & touches_bottom,
+         touches_top & (bottom > mid),
+         touches_bottom & (top < mid)],
+        [b"T", b"F", b"A", b"D"], default=b"T")
+    return labels.astype("S1").tobytes().decode("ascii")
+
+def classify_bars(group, tolerance=TOLERANCE):
+    """
+    Classifies every bar of a group (sorted by x) at once:
+      - T (Tiny): shorter than 30% of the group height.
+      - F (Full): touches (within tolerance) both the group top and bottom.
+      - A (Ascender): touches the group top and extends downward past the middle.
+      - D (Descender): touches the group bottom and extends upward past the middle.
+      - T otherwise.
+    `tolerance` is in pixels, or None for TOLERANCE_FRACTION of the group height.
+    Returns the FADT pattern string.
+    """
+    top, bottom, group_y_min, group_y_max, group_height, tolerance = _bar_geometry(group, tolerance)
+    mid = group_y_min + group_height / 2
+    return _labels(group, group_height, mid, top, bottom,
+                   top <= group_y_min + tolerance, bottom >= group_y_max - tolerance)
+
+def bar_confidence(group, tolerance=TOLERANCE):
+    """
+    How clear-cut classify_bars() was for every bar of a group.
+
+    A bar's confidence is how far its ends are from the "touches the top/bottom"
+    thresholds, in units of the tolerance: 1 when both ends are at least a tolerance
+    away from them, 0 when an end sits right on one.
+
     Returns:
-      A list of dictionaries, one per detected IMB group, with keys:
+        (confidence, alternatives): an array of per-bar confidences in [0, 1], and the
+        pattern with every bar given its second most likely state (its end nearest a
+        threshold taken the other way). A bar whose label does not change keeps it.
+    """
+    top, bottom, group_y_min, group_y_max, group_height, tolerance = _bar_geometry(group, tolerance)
+    mid = group_y_min + group_height / 2
+    top_margin = np.clip(np.abs(top - (group_y_min + tolerance)) / tolerance, 0.0, 1.0)
+    bottom_margin = np.clip(np.abs(bottom - (group_y_max - tolerance)) / tolerance, 0.0, 1.0)
+    touches_top = top <= group_y_min + tolerance
+    touches_bottom = bottom >= group_y_max - tolerance
+    flip_top = top_margin <= bottom_margin
+    alternatives = _labels(group, group_height, mid, top, bottom,
+                           touches_top ^ flip_top, touches_bottom ^ ~flip_top)
+    return np.minimum(top_margin, bottom_margin), alternatives
+
+def refine_group(closed, group, tolerance=TOLERANCE, debug=None):
+    """
+    Refines and classifies one group found on the full image: runs components again on
+    the padded crop around it only (where the bars are not merged with or split by
+    neighbouring content) and classifies the largest group found there (see
+    classify_bars() for `tolerance`). `debug` is an optional DebugContext.
+
+    Returns a result dictionary (see extract_all_imb) in `closed` coordinates, or None
+    if the refined crop no longer holds a group of MIN_GROUP_BARS bars.
+    """
+    x, y, w, h = group_bbox(group)
+    x_new = max(0, x - GROUP_PADDING)
+    y_new = max(0, y - GROUP_PADDING)
+    x_end = min(closed.shape[1], x + w + GROUP_PADDING)
+    y_end = min(closed.shape[0], y + h + GROUP_PADDING)
+    cropped = closed[y_new:y_end, x_new:x_end]
+    if debug is not None:
+        debug.save(f"imb_cropped_{x}_{y}.jpg", cropped)
+
+    refined = group_candidates(candidate_stats(cropped))
+    if not refined:
+        return None
+    bars = max(refined, key=len)
+    pattern = classify_bars(bars, tolerance)
+    confidence, alternatives = bar_confidence(bars, tolerance)
+    # Back to full-image coordinates
+    bars = bars.copy()
+    bars[:, X] += x_new
+    bars[:, Y] += y_new
+    bars[:, CY] += y_new
+    return {
+        "pattern": pattern,
+        "bbox": group_bbox(bars),
+        "bars": [(int(bx), int(by), int(bw), int(bh), cy) for bx, by, bw, bh, cy in bars.tolist()],
+        "confidence": [round(c, 3) for c in confidence.tolist()],
+        "alternatives": alternatives,
+    }
+
+def iter_imb(image, executor=None, view="binary", tolerance=TOLERANCE, debug=None):
+    """
+    Finds every IMB in the image in a single components pass and yields one result
+    per qualifying group, top to bottom, as soon as it is ready.
+
+    Steps:
+      1. Take the binarized image: the `view` of the envelope image (default the
+         binary inverse Otsu threshold; "denoised_binary" for noisy prints).
+      2. Apply a modest morphological closing with a vertical kernel (1x5) to reconnect broken vertical segments.
+      3. Use connectedComponentsWithStats to identify candidate bar regions, kept as NumPy arrays.
+      4. Filter out components with low vertical-to-horizontal ratios (letters).
+      5. Group candidate bars into clusters based on their vertical proximity (sort + sweep).
+      6. Refine and classify each group independently (see refine_group(), and
+         classify_bars() for `tolerance`); with an
+         `executor` (e.g. a ThreadPoolExecutor, for stacked envelopes with several
+         barcodes) the groups are processed in parallel, still yielded in order.
+
+    With a `debug` DebugContext, the intermediate images are written into its scratch
+    directory; without one nothing is written.
+
+    Yields:
+      Dictionaries with keys:
          'pattern': The string pattern (e.g., "FADT..."),
-         'bbox': The bounding box of the group (x, y, w, h),
-         'bars': List of candidate bar regions in the group.
+         'bbox': The bounding box of the group (x, y, w, h) in image coordinates,
+         'bars': List of candidate bar regions in the group, as (x, y, w, h, center_y),
+         'confidence': Per-bar classification confidence in [0, 1] (see bar_confidence()),
+         'alternatives': The pattern with every bar in its second most likely state.
     """
-    global itter
-    # Step 1: Grayscale and threshold
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-    save_debug_image("debug_imb_binary_full.jpg", binary)
-    
-    # Step 2: Morphological closing with vertical kernel (1x3)
+    # Step 1: Grayscale and threshold (cached views, shared with barcode extraction)
+    env = EnvelopeImage.wrap(image)
+    binary = env.view(view)
+    if debug is not None:
+        debug.save("imb_binary_full.jpg", binary)
+
+    # Step 2: Morphological closing with vertical kernel (1x5)
     kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 5))
     closed = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
-    save_debug_image("debug_imb_closed_full.jpg", closed)
-    
-    # Step 3: Connected components analysis
-    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(closed, connectivity=8)
-    
-    # Step 4: Candidate extraction with lowered thresholds for small bars,
-    # and increased vertical-to-horizontal ratio requirement to filter letters.
-    candidates = []
-    for i in range(1, num_labels):
-        x, y, w_box, h_box, area = stats[i]
-        # Require minimum area 20, minimum width 1, minimum height 3, and vertical ratio at least 2.5.
-        if (h_box / float(w_box)) < 1.5:
-            # print(itter, ": ", area, w_box, h_box, (h_box / float(w_box)))
-            continue
-        
-        center_y = y + h_box / 2
-        candidates.append((x, y, w_box, h_box, center_y))
-    
-    if not candidates:
-        print("No candidate IMB bars detected.")
-        return []
-    
-    # Step 5: Group candidates by vertical proximity.
-    groups = []
-    candidates.sort(key=lambda c: c[4])
-    y_threshold = 40  # maximum difference in center_y (in pixels) for grouping
-    for cand in candidates:
-        assigned = False
-        for group in groups:
-            if abs(cand[4] - np.mean([c[4] for c in group])) < y_threshold:
-                group.append(cand)
-                assigned = True
-                break
-        if not assigned:
-            groups.append([cand])
-    
-    # Only keep groups with a sufficient number of bars.
-    groups = [g for g in groups if len(g) >= 30]
-
-    for idx, group in enumerate(groups):
-        group.sort(key=lambda c: c[0])
-        xs = [c[0] for c in group]
-        ys = [c[1] for c in group]
-        ws = [c[2] for c in group]
-        hs = [c[3] for c in group]
-        group_bbox = (min(xs), min(ys), max([xs[i] + ws[i] for i in range(len(xs))]) - min(xs),
-                      max([ys[i] + hs[i] for i in range(len(ys))]) - min(ys))
-
-        x, y, w, h = group_bbox
-        padding = 25
-        x_new = max(0, x - padding)
-        y_new = max(0, y - padding)
-        x_end = min(closed.shape[1], x + w + padding)
-        y_end = min(closed.shape[0], y + h + padding)
-        cropped = closed[y_new:y_end, x_new:x_end]
-
-        save_debug_image("debug_img_cropped.jpg", cropped)
-
-    # Step 3.2: Connected components analysis
-    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(cropped, connectivity=8)
-
-    # Step 4.2: Candidate extraction with lowered thresholds for small bars,
-    # and increased vertical-to-horizontal ratio requirement to filter letters.
-    candidates = []
-    for i in range(1, num_labels):
-        x, y, w_box, h_box, area = stats[i]
-        # Require minimum area 20, minimum width 1, minimum height 3, and vertical ratio at least 2.5.
-        if (h_box / float(w_box)) < 1.5:
-            # print(itter, ": ", area, w_box, h_box, (h_box / float(w_box)))
-            continue
-        
-        center_y = y + h_box / 2
-        candidates.append((x, y, w_box, h_box, center_y))
-    
-    if not candidates:
+    if debug is not None:
+        debug.save("imb_closed_full.jpg", closed)
+
+    # Steps 3-5: Candidate bars and their groups over the whole image
+    groups = group_candidates(candidate_stats(closed))
+    if not groups:
         print("No candidate IMB bars detected.")
-        return []
-    
-    # Step 5: Group candidates by vertical proximity.
-    groups = []
-    candidates.sort(key=lambda c: c[4])
-    y_threshold = 40  # maximum difference in center_y (in pixels) for grouping
-    for cand in candidates:
-        assigned = False
-        for group in groups:
-            if abs(cand[4] - np.mean([c[4] for c in group])) < y_threshold:
-                group.append(cand)
-                assigned = True
-                break
-        if not assigned:
-            groups.append([cand])
-    
-    # Only keep groups with a sufficient number of bars.
-    groups = [g for g in groups if len(g) >= 30]
-    
-    imb_results = []
-    debug_full = image.copy()
-    
-    # Step 6: Process each group.
-    for idx, group in enumerate(groups):
-        group.sort(key=lambda c: c[0])
-        xs = [c[0] for c in group]
-        ys = [c[1] for c in group]
-        ws = [c[2] for c in group]
-        hs = [c[3] for c in group]
-        group_bbox = (min(xs), min(ys), max([xs[i] + ws[i] for i in range(len(xs))]) - min(xs),
-                      max([ys[i] + hs[i] for i in range(len(ys))]) - min(ys))
-        group_y_min = group_bbox[1]
-        group_y_max = group_bbox[1] + group_bbox[3]
-        group_height = group_y_max - group_y_min
-        mid = group_y_min + group_height / 2
-        tolerance = 15  # pixels
-        
-        pattern = ""
-        for (x, y, w_box, h_box, cy) in group:
-            top = y
-            bottom = y + h_box
-            # If the candidate is very short relative to the group, classify as T.
-            if h_box < 0.3 * group_height:
-                label = "T"
-            else:
-                # F: candidate touches both top and bottom.
-                if top <= group_y_min + tolerance and bottom >= group_y_max - tolerance:
-                    label = "F"
-                # A: candidate touches top and extends downward past the middle.
-                elif top <= group_y_min + tolerance and bottom > mid:
-                    label = "A"
-                # D: candidate touches bottom and extends upward past the middle.
-                elif bottom >= group_y_max - tolerance and top < mid:
-                    label = "D"
-                else:
-                    label = "T"
-            pattern += label
-            cv2.rectangle(debug_full, (x, y), (x + w_box, y + h_box), (255, 0, 0), 1)
-            cv2.putText(debug_full, label, (x, y + h_box // 2), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 1)
-        
-        imb_results.append({
-            "pattern": pattern,
-            "bbox": group_bbox,
-            "bars": group
-        })
-        cv2.rectangle(debug_full, (group_bbox[0], group_bbox[1]),
-                      (group_bbox[0] + group_bbox[2], group_bbox[1] + group_bbox[3]),
-                      (0, 255, 0), 2)
-        cv2.putText(debug_full, f"IMB {idx+1}: {pattern[:900]}", 
-                    (group_bbox[0], group_bbox[1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
-    
-    itter += 1
-    save_output_image("debug_imb_groups" + str(itter) + ".jpg", debug_full)
-    return imb_results
\ No newline at end of file
+        return
+
+    # Step 6: Refine and classify every group
+    refine = functools.partial(refine_group, closed, tolerance=tolerance, debug=debug)
+    if executor is not None and len(groups) > 1:
+        results = executor.map(refine, groups)
+    else:
+        results = (refine(group) for group in groups)
+    for result in results:
+        if result is not None:
+            yield result
+
+def extract_all_imb(image, executor=None, view="binary", tolerance=TOLERANCE, debug=None):
+    """
+    Attempts to detect multiple Intelligent Mail Barcodes (IMBs) in the entire image
+    using open source methods. All of iter_imb(), as a list; with a `debug`
+    DebugContext the groups are also drawn into its imb_groups.jpg.
+
+    Returns:
+      A list of dictionaries, one per detected IMB group, with keys:
+         'pattern': The string pattern (e.g., "FADT..."),
+         'bbox': The bounding box of the group (x, y, w, h) in image coordinates,
+         'bars': List of candidate bar regions in the group, as (x, y, w, h, center_y),
+         'confidence': Per-bar classification confidence in [0, 1],
+         'alternatives': The pattern with every bar in its second most likely state.
+    """
+    imb_results = list(iter_imb(image, executor, view, tolerance, debug))
+
+    if debug is not None:
+        # Annotate each bar with its classification, and each group with its pattern
+        debug_full = cv2.cvtColor(EnvelopeImage.wrap(image).view("gray"), cv2.COLOR_GRAY2BGR)
+        for idx, result in enumerate(imb_results):
+            bbox = result["bbox"]
+            for (bx, by, bw, bh, _), label in zip(result["bars"], result["pattern"]):
+                cv2.rectangle(debug_full, (bx, by), (bx + bw, by + bh), (255, 0, 0), 1)
+                cv2.putText(debug_full, label, (bx, by + bh // 2), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 1)
+            cv2.rectangle(debug_full, (bbox[0], bbox[1]),
+                          (bbox[0] + bbox[2], bbox[1] + bbox[3]),
+                          (0, 255, 0), 2)
+            cv2.putText(debug_full, f"IMB {idx+1}: {result['pattern'][:900]}",
+                        (bbox[0], bbox[1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
+        debug.save("imb_groups.jpg", debug_full)
+    return imb_results
@@ -0,0 +1,28 @@
+import cv2
+
+# Size the cameras are configured for in takePictures (width, height).
+CAPTURE_SIZE = (2028, 1080)
+
+
+def y_plane(frame, size=CAPTURE_SIZE):
+    """
+    Returns the luma (Y) plane of a packed YUV420 frame as a zero-copy view.
+
+    picamera2 hands YUV420 frames back as a single 2D array of height * 3/2 rows (Y
+    followed by the quarter-size U and V planes), with rows padded to the stride.
+    The Y plane is simply the first `height` rows and `width` columns.
+    Frames that already are a single plane of `size` are returned unchanged.
+    """
+    width, height = size
+    return frame[:height, :width]
+
+
+def to_gray(image):
+    """
+    Returns a single-channel image. Grayscale input (the normal case now that the whole
+    pipeline runs on the Y plane) is passed through untouched; BGR input, e.g. a
+    colour JPEG given to one of the CLIs, is converted.
+    """
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
@@ -0,0 +1,81 @@
+import queue
+import logging
+import threading
+import numpy as np
+import pytesseract
+
+# tesserocr binds libtesseract directly, so an engine is loaded once and reused across
+# envelopes. Without it we fall back to pytesseract, which writes a temp image, forks
+# the tesseract binary and reloads the traineddata on every call.
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+OCR_LANG = "eng"
+OCR_OEM = 3   # default engine mode
+OCR_PSM = 6   # assume a single uniform block of text
+
+# Engines per process: one per envelope worker is enough, OCR runs once per envelope
+POOL_SIZE = 1
+
+
+class OcrEnginePool:
+    """
+    A fixed set of long-lived, pre-initialized Tesseract engines. Each recognize() call
+    borrows an engine, feeds it the NumPy buffer directly and returns it to the pool.
+    """
+
+    def __init__(self, size=POOL_SIZE, lang=OCR_LANG, oem=OCR_OEM, psm=OCR_PSM):
+        self.size = size
+        self._engines = queue.Queue()
+        for _ in range(size):
+            self._engines.put(tesserocr.PyTessBaseAPI(lang=lang, oem=oem, psm=psm))
+
+    def recognize(self, image):
+        """Returns the text Tesseract reads in `image` (grayscale or BGR uint8)."""
+        buf = np.ascontiguousarray(image, dtype=np.uint8)
+        height, width = buf.shape[:2]
+        channels = 1 if buf.ndim == 2 else buf.shape[2]
+        engine = self._engines.get()
+        try:
+            engine.SetImageBytes(buf.tobytes(), width, height, channels, width * channels)
+            return engine.GetUTF8Text()
+        finally:
+            engine.Clear()
+            self._engines.put(engine)
+
+    def close(self):
+        for _ in range(self.size):
+            self._engines.get().End()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_warmed_up = False
+
+
+def warm_up(size=POOL_SIZE):
+    """
+    Creates this process's engine pool (loading the traineddata) ahead of the first
+    envelope. Called at daemon start, and in every envelope worker process.
+    """
+    global _pool, _warmed_up
+    with _pool_lock:
+        if _warmed_up:
+            return
+        _warmed_up = True
+        if tesserocr is None:
+            logging.warning("tesserocr not installed; OCR falls back to one tesseract process per call")
+            return
+        _pool = OcrEnginePool(size)
+        logging.info(f"OCR engine pool ready ({size} engine(s), lang={OCR_LANG})")
+
+
+def image_to_string(image):
+    """OCR through the warm engine pool, or pytesseract if there is none."""
+    if not _warmed_up:
+        warm_up()
+    if _pool is not None:
+        return _pool.recognize(image)
+    return pytesseract.image_to_string(image, config=f"--oem {OCR_OEM} --psm {OCR_PSM}", lang=OCR_LANG)
@@ -0,0 +1,284 @@
+import os
+import json
+import queue
+import logging
+import threading
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import cv2
+from frame_container import FrameContainerWriter
+from scheduling import apply_to_current_thread, init_worker_process
+
+# Sentinel pushed through the queues to shut the stages down in order
+_STOP = object()
+
+
+# Overload policies for a stage whose input queue is full
+BLOCK = "block"              # block the producer (for the first stage: the trigger)
+DROP_OLDEST = "drop_oldest"  # discard the oldest queued item to make room
+DEGRADE = "degrade"          # keep everything, but run `degraded_func` while backed up
+
+
+def _noop():
+    return None
+
+
+class Stage:
+    """
+    One step of the in-process pipeline: worker(s) that take items from a bounded input
+    queue, call `func(item)` and hand the result to the next stage.
+
+    Items are plain dicts (with at least a "uuid" key) holding NumPy arrays, so nothing
+    is written to disk between stages. Returning None from `func` drops the item.
+
+    Parameters:
+        workers (int): Number of items processed concurrently.
+        use_processes (bool): Run `func` in a pool of `workers` processes instead of in
+            the worker threads (for CPU-heavy stages; `func` and items must pickle).
+        overload (str): What put() does when the input queue is full: BLOCK,
+            DROP_OLDEST or DEGRADE.
+        degraded_func: Cheaper variant of `func` used by the DEGRADE policy for items
+            taken off a queue that was full (the stage is not keeping up).
+        initializer: Called once in each worker process when the pool starts.
+        cpu_plan (dict): {"cores": [...], "nice": n} applied to the stage's worker
+            threads, or to its worker processes when `use_processes` is set.
+    """
+
+    def __init__(self, name, func, queue_size=4, workers=1, use_processes=False,
+                 overload=BLOCK, degraded_func=None, initializer=None, cpu_plan=None):
+        if overload == DEGRADE and degraded_func is None:
+            raise ValueError(f"Stage '{name}' uses the degrade policy but has no degraded_func")
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.use_processes = use_processes
+        self.overload = overload
+        self.degraded_func = degraded_func
+        self.initializer = initializer
+        self.cpu_plan = cpu_plan
+        self.input = queue.Queue(maxsize=queue_size)
+        self.next = None
+        self.audit = None
+        self.dropped = 0
+        self.restarts = 0
+        self._threads = []
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._stop_lock = threading.Lock()
+        self._running_workers = 0
+        self._stopping = False
+
+    def _start_executor(self):
+        # fork keeps worker start-up cheap and avoids re-importing the daemon's main
+        # module (which would re-open the cameras) in every worker; forkserver and spawn
+        # both import it. The parent has threads by then (Picamera2's, and on a restart
+        # the capture, uploader and audit threads), which fork accepts knowingly: a
+        # worker only runs the stage's func and initializer, and never touches the
+        # cameras, rings, spool or locks it inherits.
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=functools.partial(init_worker_process, self.name, self.cpu_plan,
+                                          self.initializer))
+        # Start the worker processes now rather than on the first envelope
+        for future in [executor.submit(_noop) for _ in range(self.workers)]:
+            future.result()
+        return executor
+
+    def _restart_executor(self, broken):
+        """
+        Replaces the process pool after a worker died (e.g. a native crash in OpenCV or
+        tesserocr), which leaves a ProcessPoolExecutor unusable. Several worker threads
+        can see the same broken pool; only the first one replaces it.
+        """
+        with self._executor_lock:
+            if self._executor is broken:
+                logging.error(f"Stage '{self.name}' worker process died, restarting its pool")
+                broken.shutdown(wait=False)
+                self._executor = self._start_executor()
+                self.restarts += 1
+            return self._executor
+
+    def start(self):
+        if self.use_processes:
+            self._executor = self._start_executor()
+        self._running_workers = self.workers
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"Stage-{self.name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def join(self, timeout=None):
+        for t in self._threads:
+            t.join(timeout)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def put(self, item, block=True, timeout=None):
+        """
+        Queues an item for this stage, applying the stage's overload policy. Once the
+        stage is stopping (the shutdown sentinel was queued), new items are dropped.
+        """
+        if item is _STOP:
+            self._stopping = True
+        elif self._stopping:
+            logging.warning(f"Stage '{self.name}' is stopping, dropped {item.get('uuid')}")
+            return
+        if self.overload != DROP_OLDEST:
+            self.input.put(item, block=block, timeout=timeout)
+            return
+        while True:
+            try:
+                self.input.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    oldest = self.input.get_nowait()
+                except queue.Empty:
+                    continue
+                if oldest is _STOP:
+                    # Never drop the shutdown sentinel. The stage is stopping, so nothing
+                    # queued behind it would be processed anyway: drop the new item
+                    self.input.put(oldest)
+                    if item is not _STOP:
+                        logging.warning(f"Stage '{self.name}' is stopping, dropped {item.get('uuid')}")
+                    return
+                self.dropped += 1
+                logging.warning(f"Stage '{self.name}' overloaded, dropped {oldest.get('uuid')}")
+
+    def _process(self, item):
+        func = self.func
+        if self.overload == DEGRADE and self.input.qsize() >= max(1, self.input.maxsize - 1):
+            logging.warning(f"Stage '{self.name}' backed up, degrading {item.get('uuid')}")
+            func = self.degraded_func
+        executor = self._executor
+        if executor is None:
+            return func(item)
+        try:
+            return executor.submit(func, item).result()
+        except BrokenProcessPool:
+            # The item may be the one that killed the worker, so it gets one retry on
+            # the new pool; a second crash is logged as a failure of the item by _run
+            executor = self._restart_executor(executor)
+            return executor.submit(func, item).result()
+
+    def _run(self):
+        if self.cpu_plan and self._executor is None:
+            apply_to_current_thread(threading.current_thread().name,
+                                    self.cpu_plan.get("cores"), self.cpu_plan.get("nice"))
+        while True:
+            item = self.input.get()
+            if item is _STOP:
+                with self._stop_lock:
+                    self._running_workers -= 1
+                    last = self._running_workers == 0
+                if not last:
+                    # Pass the sentinel on to the sibling workers of this stage
+                    self.input.put(_STOP)
+                elif self.next is not None:
+                    self.next.put(_STOP)
+                return
+            try:
+                result = self._process(item)
+            except Exception as e:
+                logging.error(f"Stage '{self.name}' failed on {item.get('uuid')}: {e}")
+                continue
+            if result is None:
+                continue
+            if self.audit is not None:
+                self.audit.record(self.name, result)
+            if self.next is not None:
+                self.next.put(result)
+
+
+class AuditWriter:
+    """
+    Optional side-channel that persists stage outputs for audit and replay. It runs on
+    its own thread behind its own bounded queue and drops records rather than ever
+    slowing the pipeline down.
+
+    What gets written per stage:
+      - "capture":  <uuid>_preprocessing.ebf frame container (replay with processPictures)
+      - "select":   <uuid>_<camera>.jpg best frames (replay with envelopeProcessTrigger)
+      - "envelope": <uuid>_report.json
+    """
+
+    def __init__(self, root, stages=("select", "envelope"), queue_size=16):
+        self.root = root
+        self.stages = set(stages)
+        self._queue = queue.Queue(maxsize=queue_size)
+        os.makedirs(root, exist_ok=True)
+        threading.Thread(target=self._run, name="AuditWriter", daemon=True).start()
+
+    def record(self, stage_name, item):
+        if stage_name not in self.stages:
+            return
+        try:
+            # Shallow copy: later stages may add/remove keys while we are writing
+            self._queue.put_nowait((stage_name, dict(item)))
+        except queue.Full:
+            logging.warning(f"Audit queue full, dropping {stage_name} record for {item.get('uuid')}")
+
+    def _run(self):
+        while True:
+            stage_name, item = self._queue.get()
+            try:
+                self._write(stage_name, item)
+            except Exception as e:
+                logging.error(f"Audit write failed for {stage_name} {item.get('uuid')}: {e}")
+
+    def _write(self, stage_name, item):
+        base = os.path.join(self.root, item["uuid"])
+        if stage_name == "capture":
+            # Camera index in the container follows camera name order (camera0, camera1)
+            frames = [(idx, frame) for idx, (_, cam_frames) in enumerate(sorted(item["frames"].items()))
+                      for frame in cam_frames]
+            if not frames:
+                return
+            first = frames[0][1]
+            with FrameContainerWriter(base + "_preprocessing.ebf", first.shape, first.dtype,
+                                      item["uuid"]) as writer:
+                for idx, frame in frames:
+                    writer.append(idx, frame)
+        elif stage_name == "select":
+            for cam, image in item["images"].items():
+                cv2.imwrite(f"{base}_{cam}.jpg", image)
+        elif stage_name == "envelope":
+            with open(base + "_report.json", "w") as f:
+                json.dump(item.get("report"), f, indent=2, default=str)
+
+
+class Pipeline:
+    """
+    Chains stages with bounded in-memory queues: submit() feeds the first stage and each
+    stage's output becomes the next stage's input.
+    """
+
+    def __init__(self, stages, audit=None):
+        self.stages = stages
+        for upstream, downstream in zip(stages, stages[1:]):
+            upstream.next = downstream
+        for stage in stages:
+            stage.audit = audit
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+        logging.info("Pipeline started: " + " -> ".join(s.name for s in self.stages))
+
+    def submit(self, item, stage=None, block=True, timeout=None):
+        """
+        Queues `item` for the first stage, or for the stage named `stage` (e.g. to replay
+        a saved capture straight into "select"). Raises queue.Full if non-blocking and
+        the stage's queue is full.
+        """
+        target = self.stages[0] if stage is None else next(s for s in self.stages if s.name == stage)
+        target.put(item, block=block, timeout=timeout)
+
+    def stop(self, timeout=None):
+        """Lets queued items drain, then stops every stage."""
+        self.stages[0].put(_STOP)
+        for stage in self.stages:
+            stage.join(timeout)
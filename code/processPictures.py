@@ -2,85 +2,111 @@ import threading
 import uuid
 import picamera2
 import time
-import pickle
 import cv2
-import numpy as np
 import os
 import shutil
+from frame_container import open_frames, camera_frames
+from frame_selection import ranked_frame_indices, band_frame_ranking, SCORE_SCALE, REFINE_TOP
 
 _DEBUG = True
 
+# How frames are ranked:
+#   "band"   - sharpness inside the localized barcode band (falls back to "global"
+#              when no frame shows a band)
+#   "global" - sharpness over the whole frame, or SCORE_ROI if set
+SCORING_MODE = "band"
+
+# Region of each frame to score in "global" mode, as (x, y, w, h), or None for all of it
+SCORE_ROI = None
+
+# Next-best frames kept per camera for the envelope stage's IMB read fallbacks
+ALTERNATE_FRAMES = 1
+
+def _rankFrames(array, count):
+    """Indices of (at most) the `count` best frames of one camera, best first."""
+    if SCORING_MODE == "band":
+        ranking = band_frame_ranking(array)
+        if ranking:
+            return ranking[:count]
+    return ranked_frame_indices(array, scale=SCORE_SCALE, roi=SCORE_ROI,
+                                refine_top=max(count, REFINE_TOP))[:count]
+
 def _processPicturesHelper(array):
-    allEdgeIntensity = []
-    for i in range(len(array)):
-        blurred = cv2.GaussianBlur(array[i], (3, 3), 0)
-        laplacian = cv2.Laplacian(blurred, cv2.CV_64F)
-        laplacian_abs = np.uint8(np.absolute(laplacian))
-        allEdgeIntensity.append([i, np.mean(laplacian_abs)])
-    ranged_images = sorted(allEdgeIntensity, key=lambda x: x[1], reverse=True)
-    return array[ranged_images[0][0]]
-def processPictures(pickleFile):
+    return array[_rankFrames(array, 1)[0]]
+
+def select_frames(item):
+    """
+    Pipeline selection stage: replaces the item's "frames" (camera -> list of frames)
+    with "images" (camera -> best frame) and "alternates" (camera -> the next
+    ALTERNATE_FRAMES best frames, best first). Items without any frames are dropped.
+    """
+    frames = item.pop("frames")
+    ranked = {cam: [cam_frames[i] for i in _rankFrames(cam_frames, 1 + ALTERNATE_FRAMES)]
+              for cam, cam_frames in frames.items() if len(cam_frames)}
+    item["images"] = {cam: cam_frames[0] for cam, cam_frames in ranked.items()}
+    item["alternates"] = {cam: cam_frames[1:] for cam, cam_frames in ranked.items()}
+    if not item["images"]:
+        print(f"No frames captured for {item['uuid']}")
+        return None
+    return item
+
+def processPictures(containerFile):
     start_time_all = time.perf_counter()
 
     if _DEBUG:
         print(f"[DEBUG][{time.perf_counter():.3f}] Starting processPictures")
     
-    #1. Retrieve Data
-    with open(pickleFile, "rb") as curFile:
-        data = pickle.load(curFile)
+    #1. Map the frame container; frames are scored in place, nothing is deserialized
+    header, records = open_frames(containerFile)
 
     #2. Various set-up functions for placement of data, importing uuid, etc.
-    curUuid = data["uuid"]
+    curUuid = header["uuid"]
 
     os.makedirs("./cache2", exist_ok=True)
-    os.makedirs("./tmp2", exist_ok=True)
-
-    cache_picture_path0 = os.path.join("./cache2", curUuid + "DEBUG0.jpg")
-    tmp_picture_path0 = os.path.join("./tmp", curUuid + "DEBUG0.jpg")
-    cache_picture_path1 = os.path.join("./cache2", curUuid + "DEBUG1.jpg")
-    tmp_picture_path1 = os.path.join("./tmp", curUuid + "DEBUG1.jpg")
-
+    os.makedirs("./tmp", exist_ok=True)
 
     if _DEBUG:
         start_time = time.perf_counter()
         print(f"[DEBUG][{time.perf_counter():.3f}] Starting _processPicturesHelper")
         # print(f"[DEBUG][{time.perf_counter():.3f}] Camera Verification: {data}")
 
-    #3. Here we go - the big processing!
-    camera0Image = _processPicturesHelper(data['camera0'])
-    camera1Image = _processPicturesHelper(data['camera1'])
+    #3. Here we go - the big processing! Frames are already Y-plane (grayscale) only.
+    # A camera can have no frames (e.g. it captured nothing in the window); it is
+    # reported and skipped, as in select_frames
+    newData = {"uuid": curUuid}
+    for cam_idx in (0, 1):
+        cam_frames = camera_frames(records, cam_idx)
+        if not len(cam_frames):
+            print(f"No frames captured by camera{cam_idx} for {curUuid}")
+            continue
+        newData[f"camera{cam_idx}"] = _processPicturesHelper(cam_frames)
+    if len(newData) == 1:
+        print(f"No frames captured for {curUuid}")
+        return
 
     if _DEBUG:
         elapsed = time.perf_counter() - start_time
         print(f"[DEBUG][{time.perf_counter():.3f}] Process Picture Helper took {elapsed:.3f} sec")
 
-    #4. Prep for export and export to temp in ./tmp2
-    newData = {
-        "camera0": camera0Image,
-        "camera1": camera1Image,
-        "uuid": data["uuid"]
-    }
-    
+    #4. Export to temp in ./tmp, then #5. move to ./cache2
     if _DEBUG:
         start_time = time.perf_counter()
 
-    cv2.imwrite(tmp_picture_path0, camera0Image)
-    cv2.imwrite(tmp_picture_path1, camera1Image)
-    
-    if _DEBUG:
-        elapsed = time.perf_counter() - start_time
-        print(f"[DEBUG][{time.perf_counter():.3f}] PKL dump took took {elapsed:.3f} sec")
-
-    #5. Move from ./tmp2 to ./cache2
-
-    shutil.move(tmp_picture_path0, cache_picture_path0)
-    shutil.move(tmp_picture_path1, cache_picture_path1)
+    for cam_idx in (0, 1):
+        image = newData.get(f"camera{cam_idx}")
+        if image is None:
+            continue
+        tmp_picture_path = os.path.join("./tmp", curUuid + f"DEBUG{cam_idx}.jpg")
+        cache_picture_path = os.path.join("./cache2", curUuid + f"DEBUG{cam_idx}.jpg")
+        cv2.imwrite(tmp_picture_path, image)
+        shutil.move(tmp_picture_path, cache_picture_path)
 
     if _DEBUG:
-        
+        elapsed = time.perf_counter() - start_time
+        print(f"[DEBUG][{time.perf_counter():.3f}] Export took {elapsed:.3f} sec")
         total_elapsed_all = time.perf_counter() - start_time_all
-        print(f"[DEBUG][{time.perf_counter():.3f}] Finished processing => {cache_picture_path0}, total {total_elapsed_all:.3f} sec")
+        print(f"[DEBUG][{time.perf_counter():.3f}] Finished processing {curUuid} into ./cache2, total {total_elapsed_all:.3f} sec")
 
 if __name__ == "__main__":
-    print("THIS IS DEBUG ONLY - CALL processPictures() DIRECTLY WITH PICKLE FILE FOR PRODUCTION")
-    processPictures("./cache1/e74e8404-8fdb-497a-83b2-59109e63c364_preprocessing.pkl")
\ No newline at end of file
+    print("THIS IS DEBUG ONLY - CALL processPictures() DIRECTLY WITH A FRAME CONTAINER FOR PRODUCTION")
+    processPictures("./cache1/e74e8404-8fdb-497a-83b2-59109e63c364_preprocessing.ebf")
\ No newline at end of file
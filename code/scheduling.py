@@ -0,0 +1,42 @@
+import os
+import logging
+import threading
+
+# CPU placement for the daemon's threads and worker processes.
+#
+# On Linux both CPU affinity and nice values are per *thread* (a thread is addressed by
+# its native thread id), so every setting here is applied by the thread itself, from
+# inside the thread, using threading.get_native_id(). Worker processes apply their
+# setting once in the pool initializer, before they run any work.
+
+
+def apply_to_current_thread(name, cores=None, nice=None):
+    """
+    Pins the calling thread to `cores` and sets its nice value.
+    Failures (e.g. a negative nice value without CAP_SYS_NICE) are logged, not raised,
+    so a mis-sized plan never takes a stage down.
+    """
+    tid = threading.get_native_id()
+    if cores is not None:
+        try:
+            os.sched_setaffinity(tid, cores)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not pin {name} (tid {tid}) to cores {cores}: {e}")
+    if nice is not None:
+        try:
+            os.setpriority(os.PRIO_PROCESS, tid, nice)
+        except OSError as e:
+            logging.warning(f"Could not set nice {nice} for {name} (tid {tid}): {e}")
+    logging.info(f"{name} (tid {tid}) running on cores {sorted(os.sched_getaffinity(tid))}, "
+                 f"nice {os.getpriority(os.PRIO_PROCESS, tid)}")
+
+
+def init_worker_process(name, plan, initializer=None):
+    """
+    Pool initializer for worker processes: applies `plan` ({"cores": [...],
+    "nice": n}) and then runs the stage's own `initializer`, if any.
+    """
+    if plan:
+        apply_to_current_thread(f"{name} worker {os.getpid()}", plan.get("cores"), plan.get("nice"))
+    if initializer is not None:
+        initializer()
@@ -1,22 +1,45 @@
 import threading
+import functools
 import uuid
 import time
-import pickle
 import os
 import sys
 import shutil
-import numpy as np
 from picamera2 import Picamera2
 from PIL import Image
-from collections import deque
+from frame_ring import FrameRing
+from frame_container import FrameContainerWriter
+from frame_selection import TopKFrameSelector, band_sharpness, frame_score
+from processPictures import SCORING_MODE, SCORE_ROI
+from luma import CAPTURE_SIZE, y_plane
+from scheduling import apply_to_current_thread
 
 _DEBUG = True
 
-# Holds *only the most recent* frame from each camera
-latest_frames = {"camera0": None, "camera1": None}
+# Each camera writes the Y (luma) plane of every frame into its own preallocated
+# shared-memory ring; everything downstream runs on grayscale, so the chroma planes are
+# never copied. 80 slots at 20 FPS keeps the last ~4 seconds, enough for a full capture
+# window plus the handoff.
+RING_SLOTS = 80
+RING_NAMES = {"camera0": "ebox_camera0", "camera1": "ebox_camera1"}
+CAMERA_INDEX = {"camera0": 0, "camera1": 1}
 
-# A single lock to protect read/write access to latest_frames
-lock = threading.Lock()
+# Frames are scored as they arrive (frame_selection.frame_score, in processPictures'
+# SCORING_MODE) and only the CAPTURE_TOP_K best per camera are written out. Set to None
+# to write every frame of the window to the container.
+CAPTURE_TOP_K = 3
+
+# Adaptive capture: stop the window as soon as a frame shows an IMB-like band that is at
+# least this sharp (frame_selection.band_sharpness: mean absolute Laplacian inside the
+# band). The `duration` passed to capture_and_save stays the ceiling.
+# Measured on synthetic envelopes at CAPTURE_SIZE: a sharp barcode scores about 21, after
+# a 3 px Gaussian blur about 15, 5 px about 12, 9 px about 7.5. Recalibrate from real
+# captures (print band_sharpness of frames whose barcode decodes) before relying on it.
+ADAPTIVE_CAPTURE = True
+SHARPNESS_THRESHOLD = 14.0
+
+# Rings are created by the capture threads once the first frame's shape is known
+frame_rings = {"camera0": None, "camera1": None}
 
 # Initialize both cameras (only done once)
 camera0 = Picamera2(0)
@@ -28,7 +51,7 @@ for cam, cam_id in zip([camera0, camera1], [0, 1]):
         cam.create_video_configuration(
             main={
                 "format": "YUV420",
-                "size": (2028, 1080),
+                "size": CAPTURE_SIZE,
             },
             controls={
                 "FrameRate": 20,
@@ -44,30 +67,36 @@ for cam, cam_id in zip([camera0, camera1], [0, 1]):
         print(f"[DEBUG] Camera {cam_id} started.")
 
 
-def capture_continuous(cam, key):
+def capture_continuous(cam, key, cpu_plan=None):
     """
-    Continuously grab frames from the camera and update `latest_frames[key]` with
-    the newest frame (numpy array). Only store a single frame in memory at any time.
+    Continuously grab frames from the camera and write their Y plane into the
+    shared-memory ring `frame_rings[key]`, which is created from the first frame.
+    Other processes can attach to the same ring by name (see RING_NAMES).
+    `cpu_plan` ({"cores": [...], "nice": n}) pins this thread, so heavy processing
+    elsewhere cannot starve it and make it drop frames.
     """
-    global latest_frames
+    if cpu_plan:
+        apply_to_current_thread(f"capture-{key}", cpu_plan.get("cores"), cpu_plan.get("nice"))
+    frame = y_plane(cam.capture_array("main"))
+    ring = FrameRing.create(RING_NAMES[key], frame.shape, frame.dtype, RING_SLOTS)
+    frame_rings[key] = ring
+    if _DEBUG:
+        print(f"[DEBUG] Ring '{ring.name}' created: {RING_SLOTS} x {frame.shape} {frame.dtype}")
     while True:
-        frame = cam.capture_array("main")
-        # Hold the lock just long enough to update the dictionary reference
-        with lock:
-            latest_frames[key] = frame
-        # Short sleep to reduce CPU usage
-        time.sleep(0.005)
+        ring.write(frame)
+        frame = y_plane(cam.capture_array("main"))
 
 
-def start_continuous_capture():
+def start_continuous_capture(cpu_plan=None):
     """
-    Start background threads that continuously update the global `latest_frames`
-    for each camera.
+    Start background threads that continuously fill the frame ring of each camera,
+    optionally pinned according to `cpu_plan` (see capture_continuous).
     """
     for cam, key in [(camera0, "camera0"), (camera1, "camera1")]:
         t = threading.Thread(
             target=capture_continuous,
-            args=(cam, key),
+            args=(cam, key, cpu_plan),
+            name=f"Capture-{key}",
             daemon=True
         )
         t.start()
@@ -76,97 +105,152 @@ def start_continuous_capture():
         print("[DEBUG] Continuous capturing threads started.")
 
 
-def capture_for_duration(duration=2.0):
+def capture_window(duration=2.0, top_k=CAPTURE_TOP_K, adaptive=ADAPTIVE_CAPTURE,
+                   sharpness_threshold=SHARPNESS_THRESHOLD, start_time=None, on_frame=None):
+    """
+    Runs one capture window on both cameras (simultaneously), reading frames from the
+    camera rings from `start_time` (time.monotonic(), default now) for `duration`
+    seconds. Since the rings keep the last few seconds, a window can start in the past,
+    e.g. at the moment of a trigger that was queued behind another capture.
+
+    With `top_k` set, every frame is scored as it arrives (frame_score, in SCORING_MODE)
+    and only the `top_k` best frames per camera are kept. With `top_k=None`, nothing is kept and every frame is
+    handed to `on_frame(key, seq, timestamp, view)` (required then) as it arrives instead.
+
+    With `adaptive` set, the window closes early once a frame's barcode band scores at
+    least `sharpness_threshold` (see band_sharpness; in "band" mode the selection score
+    is reused); `duration` is then only the upper bound. Every camera's ring is still read up to that frame's timestamp, and a camera
+    with no frame by then is read until its first one, so no camera comes back empty
+    unless it captured nothing during the whole window.
+
+    Returns (selected, stopped_early) where `selected` maps camera key to a list of
+    (seq, timestamp, frame) tuples, best first (empty lists when `top_k` is None).
+    """
+    if top_k is None and on_frame is None:
+        raise ValueError("capture_window needs on_frame when top_k is None")
+    start_time = time.monotonic() if start_time is None else start_time
+    end_time = start_time + duration
+
+    rings = {key: ring for key, ring in frame_rings.items() if ring is not None}
+    last_seq = {key: ring.latest_seq - ring.slots for key, ring in rings.items()}
+    scorer = functools.partial(frame_score, mode=SCORING_MODE, roi=SCORE_ROI)
+    selectors = {key: TopKFrameSelector(top_k, scorer) for key in rings} if top_k else None
+    counts = {key: 0 for key in rings}
+    done = set()
+    stop_time = None
+    while len(done) < len(rings):
+        for key, ring in rings.items():
+            if key in done:
+                continue
+            for seq, timestamp, view in ring.frames_since(last_seq[key]):
+                if timestamp >= end_time or (stop_time is not None and timestamp > stop_time and counts[key]):
+                    done.add(key)
+                    break
+                last_seq[key] = seq
+                if timestamp < start_time:
+                    continue
+                score = None
+                if selectors:
+                    score = selectors[key].offer(view, seq, timestamp)
+                else:
+                    on_frame(key, seq, timestamp, view)
+                counts[key] += 1
+                if stop_time is None and adaptive:
+                    if score is not None and SCORING_MODE == "band":
+                        # Already scored: (1, band sharpness), or (0, ...) without a band
+                        band = score[1] if score[0] else None
+                    else:
+                        band = band_sharpness(view)
+                    if band is not None and band >= sharpness_threshold:
+                        # The other rings are drained up to this frame before returning
+                        stop_time = timestamp
+        if time.monotonic() >= end_time:
+            break
+        time.sleep(0.01)
+
+    selected = {key: [] for key in rings}
+    if selectors:
+        for key, selector in selectors.items():
+            selected[key] = [(seq, timestamp, frame) for _, seq, timestamp, frame in selector.ranked()]
+    return selected, stop_time is not None
+
+
+def capture_frames(item, duration=2.0):
     """
-    Collect frames from each camera for `duration` seconds.
-    Only save them if they are actually new references.
-    Returns a dict with up to the most recent 200 numpy arrays for each camera.
+    Pipeline capture stage: runs a capture window starting at the item's trigger time
+    and adds "frames", a dict of camera key -> list of frames (best first), to the item.
     """
-    # Use deque(maxlen=200) to keep only the last 200 frames for each camera
-    captured_sequence = {
-        "camera0": deque(maxlen=200),
-        "camera1": deque(maxlen=200)
-    }
-    last_seen = {"camera0": None, "camera1": None}
-
-    end_time = time.perf_counter() + duration
-    while time.perf_counter() < end_time:
-        # Grab a snapshot of the frame references outside the lock
-        print(latest_frames)
-        with lock:
-            frames_snapshot = {
-                key: latest_frames[key] for key in latest_frames
-            }
-
-        # Now process outside the lock
-        for key, frame_ref in frames_snapshot.items():
-            if frame_ref is not None and frame_ref is not last_seen[key]:
-                # We have a new frame reference -> copy the data
-                captured_sequence[key].append(np.copy(frame_ref))
-                last_seen[key] = frame_ref
-
-    # Convert each deque to a list before returning/pickling
-    return {
-        k: list(v) for k, v in captured_sequence.items()
-    }
-
-
-def capture_and_save():
+    start_time = item.get("trigger_time")
+    if CAPTURE_TOP_K:
+        selected, stopped_early = capture_window(duration, start_time=start_time)
+        item["frames"] = {key: [frame for _, _, frame in ranked] for key, ranked in selected.items()}
+    else:
+        frames = {key: [] for key in frame_rings}
+        _, stopped_early = capture_window(
+            duration, top_k=None, start_time=start_time,
+            on_frame=lambda key, seq, timestamp, view: frames[key].append(view.copy()))
+        item["frames"] = frames
+    if _DEBUG:
+        counts = {key: len(f) for key, f in item["frames"].items()}
+        print(f"[DEBUG][{time.perf_counter():.3f}] Captured {counts} for {item['uuid']} (early stop: {stopped_early})")
+    return item
+
+
+def capture_and_save(duration=2.0, top_k=CAPTURE_TOP_K, adaptive=ADAPTIVE_CAPTURE,
+                     sharpness_threshold=SHARPNESS_THRESHOLD):
     """
-    Capture for 2 seconds on both cameras (simultaneously), then
-    pickle + write frames in a background thread. Each call spawns
-    its own worker so multiple calls can overlap.
+    Capture for `duration` seconds on both cameras (simultaneously) into a frame
+    container in ./tmp, then move the finished container to ./cache1. Each call spawns
+    its own worker so multiple calls can overlap. See capture_window for `top_k`,
+    `adaptive` and `sharpness_threshold`; with `top_k=None` every frame is appended
+    to the container as it arrives.
     """
 
     def _worker():
-        # 1) Capture frames
         start_time_all = time.perf_counter()
-        if _DEBUG:
-            print(f"[DEBUG][{time.perf_counter():.3f}] Starting capture_for_duration")
+        start_time = time.monotonic()
 
-        start_time = time.perf_counter()
-        captured_frames = capture_for_duration(2.0)
-        if _DEBUG:
-            print(captured_frames)
-            elapsed = time.perf_counter() - start_time
-            print(f"[DEBUG][{time.perf_counter():.3f}] capture_for_duration took {elapsed:.3f} sec")
-
-        # 2) Ensure directories exist
+        # 1) Ensure directories exist
         os.makedirs("./tmp", exist_ok=True)
         os.makedirs("./cache1", exist_ok=True)
 
-        # Generate a UUID for this capture and add file to data being transferred
+        # Generate a UUID for this capture; it is stored in the container header
         file_uuid = str(uuid.uuid4())
-        captured_frames["uuid"] = file_uuid
+        tmp_path = os.path.join("./tmp", file_uuid + "_preprocessing.ebf")
+        final_path = os.path.join("./cache1", file_uuid + "_preprocessing.ebf")
 
-        # Build the paths for the pickle file
-        tmp_pkl_path = os.path.join("./tmp", file_uuid + "_preprocessing.pkl")
-        final_pkl_path = os.path.join("./cache1", file_uuid + "_preprocessing.pkl")
+        rings = [ring for ring in frame_rings.values() if ring is not None]
+        if not rings:
+            print("No camera rings available yet; skipping capture.")
+            return
 
-        # 3) Dump to PKL in ./tmp
+        # 2) Write frames to the container (as they arrive when keeping every frame)
         if _DEBUG:
-            print(f"[DEBUG][{time.perf_counter():.3f}] Writing PKL to temp => {tmp_pkl_path}")
-        start_time = time.perf_counter()
-        with open(tmp_pkl_path, "wb") as f:
-            pickle.dump(captured_frames, f)
+            print(f"[DEBUG][{time.perf_counter():.3f}] Capturing into container => {tmp_path}")
+        with FrameContainerWriter(tmp_path, rings[0].frame_shape, rings[0].dtype, file_uuid) as writer:
+            selected, stopped_early = capture_window(
+                duration, top_k, adaptive, sharpness_threshold, start_time,
+                on_frame=lambda key, seq, timestamp, view: writer.append(CAMERA_INDEX[key], view, seq, timestamp))
+            for key, ranked in selected.items():
+                for seq, timestamp, frame in ranked:
+                    writer.append(CAMERA_INDEX[key], frame, seq, timestamp)
+            frame_count = writer.count
         if _DEBUG:
-            elapsed = time.perf_counter() - start_time
-            print(f"[DEBUG][{time.perf_counter():.3f}] Writing PKL took {elapsed:.3f} sec")
+            elapsed = time.perf_counter() - start_time_all
+            reason = "early stop" if stopped_early else "full window"
+            print(f"[DEBUG][{time.perf_counter():.3f}] Captured {frame_count} frames in {elapsed:.3f} sec ({reason})")
 
-        # 4) Move PKL to ./cache1
-        start_time = time.perf_counter()
-        shutil.move(tmp_pkl_path, final_pkl_path)
+        # 3) Move the finished container to ./cache1
+        start_move = time.perf_counter()
+        shutil.move(tmp_path, final_path)
         if _DEBUG:
-            elapsed = time.perf_counter() - start_time
-            print(f"[DEBUG][{time.perf_counter():.3f}] Moved PKL to => {final_pkl_path} (move took {elapsed:.3f} sec)")
-
-        # Optional: Free memory right away
-        del captured_frames
+            elapsed = time.perf_counter() - start_move
+            print(f"[DEBUG][{time.perf_counter():.3f}] Moved container to => {final_path} (move took {elapsed:.3f} sec)")
 
         # Log summary
         if _DEBUG:
             total_elapsed_all = time.perf_counter() - start_time_all
-            print(f"[DEBUG][{time.perf_counter():.3f}] Finished capture => {final_pkl_path}, total {total_elapsed_all:.3f} sec")
+            print(f"[DEBUG][{time.perf_counter():.3f}] Finished capture => {final_path}, total {total_elapsed_all:.3f} sec")
 
     # Fire off the capture thread so multiple calls can happen concurrently
     threading.Thread(target=_worker, daemon=True).start()
@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import random
+import logging
+import itertools
+import struct
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+import wire_format
+
+# Results are never posted from the processing stages. They are appended to a durable
+# spool directory (one JSON file per envelope, written atomically) and a background
+# worker drains it over one keep-alive session, several envelopes per request. If the
+# link is down the results just wait in the spool, across restarts too.
+
+SERVER_URL = "http://192.168.50.6:9100/envelopeData"
+OUTBOX_DIR = "./outbox"
+
+BATCH_SIZE = 16            # envelopes per request
+REQUEST_TIMEOUT = 10       # seconds
+POLL_INTERVAL = 1.0        # seconds; envelope workers are separate processes, so poll the spool
+BACKOFF_INITIAL = 1.0      # seconds
+BACKOFF_MAX = 300.0        # seconds
+
+# "json": a JSON array per batch. "binary": the compact, compressed encoding in
+# wire_format (for metered cellular links); the server accepts both.
+WIRE_FORMAT = "json"
+
+_counter = itertools.count()
+
+
+def enqueue(payload, outbox_dir=OUTBOX_DIR):
+    """
+    Appends one result to the spool. Safe to call from any thread or worker process;
+    never touches the network.
+
+    Returns the path of the spooled file.
+    """
+    os.makedirs(outbox_dir, exist_ok=True)
+    # Names sort in submission order (time first); pid and counter keep them unique
+    name = f"{time.time_ns():020d}_{os.getpid()}_{next(_counter)}.json"
+    tmp_path = os.path.join(outbox_dir, "." + name + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(payload, f, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+    # Readers only ever see complete files
+    path = os.path.join(outbox_dir, name)
+    os.replace(tmp_path, path)
+    return path
+
+
+class Uploader:
+    """
+    Background worker that drains the spool to the server in batches.
+
+    A batch is POSTed as a JSON array, or in the binary wire format. Its files are
+    deleted only after a 2xx response; on a network or server error the worker backs
+    off exponentially (with jitter) and retries the same batch. A batch the server
+    rejects as malformed (4xx) is moved to outbox/rejected so it cannot block the ones
+    behind it.
+    """
+
+    def __init__(self, url=SERVER_URL, outbox_dir=OUTBOX_DIR, batch_size=BATCH_SIZE,
+                 wire=WIRE_FORMAT):
+        self.url = url
+        self.wire = wire
+        self.outbox_dir = outbox_dir
+        self.rejected_dir = os.path.join(outbox_dir, "rejected")
+        self.batch_size = batch_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        os.makedirs(self.rejected_dir, exist_ok=True)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="Uploader", daemon=True)
+        self._thread.start()
+        logging.info(f"Uploader started, {self.pending()} result(s) pending in {self.outbox_dir}")
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.session.close()
+
+    def pending(self):
+        return len(self._spooled())
+
+    def _spooled(self):
+        return sorted(name for name in os.listdir(self.outbox_dir) if name.endswith(".json"))
+
+    def _load(self, names):
+        batch, paths = [], []
+        for name in names:
+            path = os.path.join(self.outbox_dir, name)
+            try:
+                with open(path) as f:
+                    batch.append(json.load(f))
+                paths.append(path)
+            except (OSError, ValueError) as e:
+                logging.error(f"Unreadable spool file {name}, moving it aside: {e}")
+                os.replace(path, os.path.join(self.rejected_dir, name))
+        return batch, paths
+
+    def _reject(self, paths, reason):
+        logging.error(f"{reason}, moving it to {self.rejected_dir}")
+        for path in paths:
+            os.replace(path, os.path.join(self.rejected_dir, os.path.basename(path)))
+
+    def send_batch(self):
+        """
+        Sends the oldest batch in the spool.
+
+        Returns the number of results delivered (0 when the spool is empty). Raises
+        requests.RequestException when the batch should be retried later.
+        """
+        batch, paths = self._load(self._spooled()[:self.batch_size])
+        if not batch:
+            return 0
+        if self.wire == "binary":
+            try:
+                body = wire_format.encode_batch(batch)
+            except (ValueError, KeyError, TypeError, struct.error) as e:
+                # Retrying would fail the same way, so the batch goes aside like a 4xx
+                self._reject(paths, f"Could not encode a batch of {len(batch)} ({e})")
+                return 0
+            response = self.session.post(self.url, data=body,
+                                         headers={"Content-Type": wire_format.CONTENT_TYPE},
+                                         timeout=REQUEST_TIMEOUT)
+        else:
+            response = self.session.post(self.url, json=batch, timeout=REQUEST_TIMEOUT)
+        if 400 <= response.status_code < 500:
+            self._reject(paths, f"Server rejected a batch of {len(batch)} ({response.status_code})")
+            return 0
+        response.raise_for_status()
+        for path in paths:
+            os.remove(path)
+        return len(batch)
+
+    def flush(self):
+        """Sends everything in the spool now. Returns False if the server is unreachable."""
+        try:
+            while self.pending():
+                self.send_batch()
+        except requests.RequestException as e:
+            logging.warning(f"Upload failed, results stay spooled: {e}")
+            return False
+        return True
+
+    def _run(self):
+        backoff = BACKOFF_INITIAL
+        while not self._stopping.is_set():
+            try:
+                sent = self.send_batch()
+                backoff = BACKOFF_INITIAL
+            except requests.RequestException as e:
+                delay = backoff * random.uniform(0.5, 1.0)
+                logging.warning(f"Upload failed, {self.pending()} result(s) spooled, "
+                                f"retrying in {delay:.1f} sec: {e}")
+                self._stopping.wait(delay)
+                backoff = min(BACKOFF_MAX, backoff * 2)
+                continue
+            except Exception as e:
+                logging.error(f"Uploader error: {e}")
+                sent = 0
+            if sent:
+                logging.info(f"Uploaded {sent} result(s)")
+                continue
+            self._wakeup.wait(POLL_INTERVAL)
+            self._wakeup.clear()
@@ -0,0 +1,212 @@
+import re
+import zlib
+import struct
+import datetime
+import numpy as np
+from imb_decoder import split_tracking
+
+# Compact binary encoding of envelope results for metered (cellular) links.
+#
+# Batch:   MAGIC (4 bytes) + zlib( u16 record count + records )
+# Record (version 2):
+#          u8 version
+#          u32 capture time, seconds since 1970-01-01 in device-local wall time
+#          str location
+#          u16 barcode count, then per barcode:
+#              i16 x, i16 y, u16 w, u16 h      (bbox; x/y can be negative from padding)
+#              u16 score, u16 confidence       (x 10000; both are in [0, 1])
+#              str rung                        ("" when no read decoded)
+#              str tracking, str routing       (decoded IMB; "" tracking when none)
+#              u16 pattern count, then per pattern:
+#                  u16 bar count + bars packed 2 bits each, 4 per byte, first bar in the
+#                  high bits (F=0, A=1, D=2, T=3; 65 bars -> 17 bytes)
+#          u16 OCR field count, then per field:
+#              u8 field id (OCR_FIELDS index, or 255 followed by str name)
+#              u16 value count + str values
+# str is u16 length + UTF-8 bytes. All integers little-endian. Counts and strings are
+# capped at MAX_COUNT (lists keep their first items, strings are cut at a character
+# boundary), so a record always encodes.
+#
+# Version 1 records (u8 counts and string lengths, no score/confidence/rung/decoded
+# fields) are still decoded, for devices that have not been updated yet.
+#
+# The server expands it back into the JSON payload (WebApp/server/controllers/envelopeWire.js).
+
+MAGIC = b"EBW1"
+VERSION = 2
+CONTENT_TYPE = "application/x-ebox-batch"
+MAX_COUNT = 0xFFFF
+
+BAR_CODES = "FADT"
+OCR_FIELDS = ("ZIP Codes", "State Abbreviations", "Addresses")
+OTHER_FIELD = 255
+FIXED_POINT = 10000
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_BBOX = struct.Struct("<hhHH")
+_SCORES = struct.Struct("<HH")
+_PATTERN_RE = re.compile(r"^[FADT]+$")
+_BAR_LOOKUP = np.full(256, 255, dtype=np.uint8)
+for _code, _bar in enumerate(BAR_CODES):
+    _BAR_LOOKUP[ord(_bar)] = _code
+_PACK_WEIGHTS = np.array([64, 16, 4, 1], dtype=np.uint8)
+# Count / string length field per record version
+_COUNT = {1: struct.Struct("<B"), 2: struct.Struct("<H")}
+
+
+def pack_bars(pattern):
+    """Packs a FADT string at 2 bits per bar. Returns bytes (ceil(len / 4) long)."""
+    codes = _BAR_LOOKUP[np.frombuffer(pattern.encode("ascii"), dtype=np.uint8)]
+    if np.any(codes == 255):
+        raise ValueError(f"Not a FADT pattern: {pattern!r}")
+    padded = np.zeros(-(-len(codes) // 4) * 4, dtype=np.uint8)
+    padded[:len(codes)] = codes
+    return (padded.reshape(-1, 4) * _PACK_WEIGHTS).sum(axis=1, dtype=np.uint8).tobytes()
+
+
+def unpack_bars(packed, count):
+    """Inverse of pack_bars."""
+    data = np.frombuffer(packed, dtype=np.uint8)
+    codes = (data[:, None] >> np.array([6, 4, 2, 0], dtype=np.uint8)) & 3
+    return "".join(BAR_CODES[c] for c in codes.ravel()[:count])
+
+
+def _pack_count(n):
+    return _COUNT[VERSION].pack(min(n, MAX_COUNT))
+
+
+def _pack_str(value):
+    data = str(value).encode("utf-8")
+    if len(data) > MAX_COUNT:
+        data = data[:MAX_COUNT].decode("utf-8", "ignore").encode("utf-8")
+    return _pack_count(len(data)) + data
+
+
+def _fixed(value):
+    return int(round(min(max(float(value or 0.0), 0.0), 1.0) * FIXED_POINT))
+
+
+def _timestamp(payload):
+    moment = datetime.datetime.fromisoformat(f"{payload['DATE']}T{payload['TIME']}")
+    return int((moment - _EPOCH).total_seconds())
+
+
+def encode_record(payload):
+    """Encodes one payload (as built by envelope_processor) to bytes."""
+    out = [struct.pack("<BI", VERSION, _timestamp(payload)), _pack_str(payload.get("LOCATION", ""))]
+
+    barcodes = (payload.get("IMB") or [])[:MAX_COUNT]
+    out.append(_pack_count(len(barcodes)))
+    for entry in barcodes:
+        x, y, w, h = entry.get("BBox", (0, 0, 0, 0))
+        out.append(_BBOX.pack(x, y, w, h))
+        out.append(_SCORES.pack(_fixed(entry.get("Score")), _fixed(entry.get("Confidence"))))
+        data = entry.get("IMB Data") or {}
+        out.append(_pack_str(entry.get("Rung") or ""))
+        out.append(_pack_str(data.get("tracking", "")) + _pack_str(data.get("routing", "")))
+        # The report joins the interpreter's patterns with ", " ("None" when empty)
+        patterns = [p[:MAX_COUNT] for p in entry.get("IMB Patterns", "").split(", ")
+                    if _PATTERN_RE.match(p)][:MAX_COUNT]
+        out.append(_pack_count(len(patterns)))
+        for pattern in patterns:
+            out.append(_pack_count(len(pattern)) + pack_bars(pattern))
+
+    ocr = list((payload.get("OCR") or {}).items())[:MAX_COUNT]
+    out.append(_pack_count(len(ocr)))
+    for name, values in ocr:
+        if name in OCR_FIELDS:
+            out.append(struct.pack("<B", OCR_FIELDS.index(name)))
+        else:
+            out.append(struct.pack("<B", OTHER_FIELD) + _pack_str(name))
+        values = values[:MAX_COUNT]
+        out.append(_pack_count(len(values)))
+        out.extend(_pack_str(v) for v in values)
+    return b"".join(out)
+
+
+def decode_record(buf, offset=0):
+    """
+    Decodes one record (version 1 or 2) starting at `offset`.
+    Returns (payload, offset after the record). Barcodes come back named barcode_1..n.
+    """
+    version, seconds = struct.unpack_from("<BI", buf, offset)
+    if version not in _COUNT:
+        raise ValueError(f"Unsupported wire record version {version}")
+    offset += 5
+    moment = _EPOCH + datetime.timedelta(seconds=seconds)
+    count_field = _COUNT[version]
+
+    def count():
+        nonlocal offset
+        (n,) = count_field.unpack_from(buf, offset)
+        offset += count_field.size
+        return n
+
+    def string():
+        nonlocal offset
+        length = count()
+        offset += length
+        return bytes(buf[offset - length:offset]).decode("utf-8", "replace")
+
+    location = string()
+
+    barcodes = []
+    for i in range(count()):
+        x, y, w, h = _BBOX.unpack_from(buf, offset)
+        offset += _BBOX.size
+        entry = {"Barcode": f"barcode_{i + 1}", "BBox": [x, y, w, h]}
+        if version >= 2:
+            score, confidence = _SCORES.unpack_from(buf, offset)
+            offset += _SCORES.size
+            rung, tracking, routing = string(), string(), string()
+            entry["Score"] = score / FIXED_POINT
+            entry["Confidence"] = confidence / FIXED_POINT
+        patterns = []
+        for _ in range(count()):
+            bars = count()
+            size = -(-bars // 4)
+            patterns.append(unpack_bars(buf[offset:offset + size], bars))
+            offset += size
+        entry["IMB Patterns"] = ", ".join(patterns) if patterns else "None"
+        if version >= 2:
+            entry["IMB Data"] = split_tracking(tracking, routing) if tracking else None
+            entry["Rung"] = rung or None
+        barcodes.append(entry)
+
+    ocr = {}
+    for _ in range(count()):
+        field = buf[offset]
+        offset += 1
+        name = string() if field == OTHER_FIELD else OCR_FIELDS[field]
+        ocr[name] = [string() for _ in range(count())]
+
+    payload = {
+        "IMB": barcodes,
+        "OCR": ocr,
+        "LOCATION": location,
+        "TIME": moment.strftime("%H:%M:%S"),
+        "DATE": moment.date().isoformat(),
+    }
+    return payload, offset
+
+
+def encode_batch(payloads):
+    """Encodes and compresses a list of payloads into one request body."""
+    if len(payloads) > MAX_COUNT:
+        raise ValueError(f"A batch holds at most {MAX_COUNT} payloads")
+    body = struct.pack("<H", len(payloads)) + b"".join(encode_record(p) for p in payloads)
+    return MAGIC + zlib.compress(body, 9)
+
+
+def decode_batch(data):
+    """Inverse of encode_batch. Returns the list of payloads."""
+    if data[:4] != MAGIC:
+        raise ValueError("Not an envelope wire batch")
+    body = zlib.decompress(data[4:])
+    (count,) = struct.unpack_from("<H", body, 0)
+    offset = 2
+    payloads = []
+    for _ in range(count):
+        payload, offset = decode_record(body, offset)
+        payloads.append(payload)
+    return payloads